@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import ssl
+import sys
+from os import urandom
+from time import monotonic
+from pathlib import Path
+from asyncio import run, sleep, create_subprocess_exec
+from asyncio.subprocess import PIPE, DEVNULL
+from subprocess import run as run_process
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from aiohttp import web
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+DOWNLOADER = Path(__file__).resolve().parent.joinpath('downloader.py')
+HOST = '127.0.0.1'
+BASE_PORT = 8970
+SCENARIOS = {}
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def scenario(func):
+    '''Register a benchmark scenario
+    '''
+    SCENARIOS[func.__name__] = func
+    return func
+
+def fast_app(delay=0.01, body=b'x' * 1024):
+    '''Server answering every request after a fixed delay
+    '''
+    async def handler(request):
+        await sleep(delay)
+        return web.Response(body=body)
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    return app
+
+def throttling_app(max_concurrency=3, delay=0.2, body=b'x' * 1024):
+    '''Server answering 429 when more than max_concurrency requests are active
+    '''
+    active = 0
+    async def handler(request):
+        nonlocal active
+        if active >= max_concurrency:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        active += 1
+        try:
+            await sleep(delay)
+        finally:
+            active -= 1
+        return web.Response(body=body)
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    return app
+
+def congested_app(delay=0.01, body=b'x' * 1024):
+    '''Server whose throughput collapses as the number of active requests grows
+    '''
+    active = 0
+    async def handler(request):
+        nonlocal active
+        active += 1
+        try:
+            await sleep(delay * active ** 2)
+        finally:
+            active -= 1
+        return web.Response(body=body)
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    return app
+
+def self_signed_certificate(directory):
+    '''Create a certificate for HOST using openssl, return its path and the
+    path of its key
+    '''
+    certfile = directory.joinpath('bench.crt')
+    keyfile = directory.joinpath('bench.key')
+    run_process([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-keyout', str(keyfile), '-out', str(certfile),
+        '-subj', f'/CN={HOST}', '-addext', f'subjectAltName=IP:{HOST}',
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+async def start_servers(apps, certfile=None, keyfile=None):
+    '''Start apps on consecutive local ports (using TLS if a certificate is
+    given), return runners and base urls
+    '''
+    ssl_context = None
+    if certfile:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certfile, keyfile)
+    scheme = 'https' if ssl_context else 'http'
+    runners, bases = [], []
+    for k, app in enumerate(apps):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, HOST, BASE_PORT + k, ssl_context=ssl_context).start()
+        runners.append(runner)
+        bases.append(f'{scheme}://{HOST}:{BASE_PORT + k}')
+    return runners, bases
+
+def tree_size(directory):
+    '''Return the total size of regular files below directory
+    '''
+    return sum(path.stat().st_size for path in directory.rglob('*') if path.is_file())
+
+async def run_downloader(urls, options):
+    '''Run the downloader on urls with options, return elapsed time, counts
+    and number of bytes stored
+    '''
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        url_file = tmpdir.joinpath('bench.url')
+        url_file.write_text('\n'.join(urls) + '\n')
+        start = monotonic()
+        proc = await create_subprocess_exec(
+            sys.executable, str(DOWNLOADER), '-o', str(tmpdir.joinpath('out')),
+            *options, str(url_file),
+            stdout=PIPE, stderr=DEVNULL,
+        )
+        output, _ = await proc.communicate()
+        elapsed = monotonic() - start
+        size = tree_size(tmpdir.joinpath('out'))
+    output = output.decode()
+    stored = output.count(' content stored in ')
+    failed = output.count(' an exception occured while downloading ')
+    return elapsed, stored, failed, size
+
+async def compare(apps, urls, variants, certfile=None, keyfile=None):
+    '''Serve apps and run the downloader once per variant of options
+    '''
+    runners, bases = await start_servers(apps, certfile, keyfile)
+    try:
+        urls = [url.format(*bases) for url in urls]
+        for label, options in variants:
+            elapsed, stored, failed, size = await run_downloader(urls, options)
+            print(f"  {label:<32} {elapsed:8.2f}s {stored:6d} stored {failed:6d} failed "
+                  f"{stored / elapsed:8.1f} files/s {size / elapsed / 2**20:8.1f} MiB/s")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+@scenario
+async def throttling():
+    '''A throttling host listed first must not starve a fast host
+    '''
+    urls = [f'{{0}}/slow-{k}' for k in range(100)]
+    urls += [f'{{1}}/fast-{k}' for k in range(1000)]
+    await compare(
+        [throttling_app(), fast_app()],
+        urls,
+        [
+            ('fixed concurrency', ['-w', '16']),
+            ('adaptive per-host concurrency', ['-w', '16', '--adaptive']),
+        ],
+    )
+
+@scenario
+async def congestion():
+    '''A host slowing down under load must not hold every worker
+    '''
+    urls = []
+    for k in range(100):
+        urls.append(f'{{0}}/slow-{k}')
+        urls += [f'{{1}}/fast-{k}-{j}' for j in range(10)]
+    await compare(
+        [congested_app(), fast_app()],
+        urls,
+        [
+            ('fixed concurrency', ['-w', '16']),
+            ('adaptive per-host concurrency', ['-w', '16', '--adaptive']),
+        ],
+    )
+
+@scenario
+async def large_files():
+    '''Disk writes of large files must not stall network I/O
+    '''
+    urls = [f'{{0}}/large-{k}' for k in range(8)]
+    await compare(
+        [fast_app(0, urandom(256 * 2**20))],
+        urls,
+        [
+            ('64k writes on the event loop', ['-w', '8', '--write-buffer', '0']),
+            ('thread pool writer', ['-w', '8']),
+            ('thread pool writer, fsync 64M', ['-w', '8', '--fsync-every', str(64 * 2**20)]),
+            ('thread pool writer, O_DIRECT', ['-w', '8', '--direct']),
+            ('64k on loop, sha256 checksum', ['-w', '8', '--write-buffer', '0', '--dedup']),
+            ('thread pool writer, sha256', ['-w', '8', '--dedup']),
+        ],
+    )
+
+@scenario
+async def processes():
+    '''Spreading hashed TLS downloads over processes must use more cores
+    '''
+    urls = []
+    for k in range(100):
+        urls += [f'{{{j}}}/file-{k}' for j in range(4)]
+    with TemporaryDirectory() as tmpdir:
+        certfile, keyfile = self_signed_certificate(Path(tmpdir))
+        options = ['--ca-file', str(certfile), '--dedup']
+        await compare(
+            [fast_app(0, urandom(2**20)) for _ in range(4)],
+            urls,
+            [
+                ('single event loop', ['-w', '16'] + options),
+                ('2 processes', ['-w', '8', '--processes', '2'] + options),
+                ('4 processes', ['-w', '4', '--processes', '4'] + options),
+            ],
+            certfile, keyfile,
+        )
+
+async def main():
+    parser = ArgumentParser(description="Benchmark the downloader against local test servers.")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run among {', '.join(SCENARIOS)}, all by default.")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+    for name in args.scenarios or SCENARIOS:
+        print(f"{name}: {SCENARIOS[name].__doc__.strip()}")
+        await SCENARIOS[name]()
+# ------------------------------------------------------------------------------
+# SCRIPT
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,48 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from pathlib import Path
+from datetime import datetime, timezone
+from email.utils import format_datetime
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def parse_since(value):
+    '''Convert --since argument to an HTTP-date
+
+    Value is either an ISO 8601 date (local time unless a timezone is given)
+    or the path of an existing file whose modification time is used, e.g. the
+    manifest of the previous run.
+    '''
+    filepath = Path(value)
+    if filepath.is_file():
+        date = datetime.fromtimestamp(filepath.stat().st_mtime, timezone.utc)
+    else:
+        try:
+            date = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"neither an ISO 8601 date nor an existing file: {value}")
+    return format_datetime(date.astimezone(timezone.utc), usegmt=True)
+
+def conditional_headers(entry, since=None):
+    '''Build conditional request headers from the journal entry of a url
+    previously downloaded entirely
+
+    Without entry (url never downloaded), since is used as If-Modified-Since
+    date if given.
+    '''
+    if entry is None:
+        return {'If-Modified-Since': since} if since else {}
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class NotModified(Exception):
+    '''Raised when the server answers 304, remote content did not change
+    '''
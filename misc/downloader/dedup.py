@@ -0,0 +1,168 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import os
+import hashlib
+from json import dumps, loads
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+INDEX_FILENAME = '.downloader.index'
+INDEX_ALGORITHM = 'sha256'
+HASH_BLOCK_SIZE = 1024 * 1024  # 1M
+DIGEST_SIZES = {
+    32: 'md5',
+    40: 'sha1',
+    64: 'sha256',
+    128: 'sha512',
+}
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def parse_checksum(checksum):
+    '''Parse 'algorithm:hexdigest' or a bare hexdigest, return (algorithm, hexdigest)
+
+    Algorithm of a bare hexdigest is inferred from its length.
+    '''
+    algorithm, _, hexdigest = checksum.rpartition(':')
+    hexdigest = hexdigest.lower()
+    if not algorithm:
+        algorithm = DIGEST_SIZES.get(len(hexdigest))
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError(f"unsupported checksum: {checksum}")
+    return algorithm, hexdigest
+
+def format_checksum(checksum):
+    '''Return 'algorithm:hexdigest' of a parsed checksum, None if there is none
+    '''
+    return ':'.join(checksum) if checksum else None
+
+def hash_file(filepath, algorithms, size=None):
+    '''Hash the first size bytes (all by default) of filepath, return hashers
+    '''
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    with filepath.open('rb') as fp:
+        remaining = size
+        while remaining is None or remaining > 0:
+            block = fp.read(HASH_BLOCK_SIZE if remaining is None else min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            for hasher in hashers.values():
+                hasher.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return hashers
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class ChecksumError(Exception):
+    '''Raised when downloaded content does not match its expected checksum
+    '''
+
+class ContentIndex:
+    '''Content digests of downloaded files
+
+    When dedup is enabled, the index is persisted in the output directory as
+    JSON-lines and files whose content was already downloaded are replaced
+    by a hard link to the first copy.
+    '''
+    def __init__(self, output_dir, dedup=False):
+        self.output_dir = output_dir
+        self.dedup = dedup
+        self.filepath = output_dir.joinpath(INDEX_FILENAME)
+        self.digests = {}
+        self._fp = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if not self.dedup:
+            return
+        if self.filepath.is_file():
+            with self.filepath.open() as fp:
+                for line in fp:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        continue
+                    self.digests[record['digest']] = record
+        self._fp = self.filepath.open('a')
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def algorithms(self, checksum=None):
+        '''Return hash algorithms to compute while downloading content
+        expected to match checksum, (algorithm, hexdigest) or None
+        '''
+        algorithms = set()
+        if self.dedup:
+            algorithms.add(INDEX_ALGORITHM)
+        if checksum:
+            algorithms.add(checksum[0])
+        return algorithms
+
+    def hashers(self, checksum=None):
+        return {algorithm: hashlib.new(algorithm) for algorithm in self.algorithms(checksum)}
+
+    def verify(self, url, hashers, checksum=None):
+        '''Raise ChecksumError if content of url does not match checksum
+        '''
+        if not checksum:
+            return
+        algorithm, expected = checksum
+        digest = hashers[algorithm].hexdigest()
+        if digest != expected:
+            raise ChecksumError(f"{algorithm} mismatch for {url}: expected {expected}, got {digest}")
+
+    def _lookup(self, digest):
+        record = self.digests.get(digest)
+        if not record:
+            return None
+        filepath = self.output_dir.joinpath(record['path'])
+        try:
+            stat = filepath.stat()
+        except OSError:
+            return None
+        # file modified since it was indexed
+        if stat.st_size != record['size'] or stat.st_mtime_ns != record['mtime']:
+            return None
+        return filepath
+
+    def deduplicate(self, filepath, hashers):
+        '''Index filepath content, return the path of a previous copy filepath
+        was hard linked to or None if content is new
+        '''
+        if not self.dedup:
+            return None
+        digest = hashers[INDEX_ALGORITHM].hexdigest()
+        existing = self._lookup(digest)
+        if existing and existing != filepath:
+            tmp = filepath.with_name(f'.{filepath.name}.link')
+            try:
+                os.link(existing, tmp)
+                os.replace(tmp, filepath)
+            except OSError:
+                # e.g. filesystem without hard links, keep the copy
+                pass
+            else:
+                return existing
+        stat = filepath.stat()
+        record = {
+            'digest': digest,
+            'path': str(filepath.relative_to(self.output_dir)),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+        }
+        self.digests[digest] = record
+        self._fp.write(dumps(record) + '\n')
+        self._fp.flush()
+        return None
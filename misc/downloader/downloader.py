@@ -3,20 +3,42 @@
 # ------------------------------------------------------------------------------
 # IMPORTS
 # ------------------------------------------------------------------------------
-from os import urandom
-from pathlib import Path, PurePosixPath
+import sys
+import ssl
+from os import fstat
+from math import inf
+from time import monotonic
+from functools import partial
+from collections import namedtuple, defaultdict, deque
+from stat import S_ISFIFO, S_ISSOCK
+from pathlib import Path
 from asyncio import (
     CancelledError,
-    get_event_loop,
+    StreamReader,
+    StreamReaderProtocol,
+    get_running_loop,
+    run,
     create_task,
     gather,
+    sleep,
     Queue,
-    Lock,
+    Semaphore,
 )
-from datetime import datetime
+from logging import DEBUG, INFO, WARNING, ERROR
 from argparse import ArgumentParser
 from yarl import URL
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientResponseError, TCPConnector, TraceConfig
+from logs import LOGGER, LEVELS, setup_logging
+from metrics import Metrics
+from journal import Journal, CHECKPOINT_SIZE
+from segmented import Segment, SegmentedDownload, SegmentError, SEGMENT_THRESHOLD
+from throttle import HostScheduler, RATE, BURST
+from dedup import ContentIndex, ChecksumError, hash_file, parse_checksum, format_checksum
+from retry import RetryPolicy, retry_after, RETRIES, RETRY_DELAY, RETRY_MAX_DELAY
+from cache import NotModified, conditional_headers, parse_since
+from writer import FileWriter, WRITE_BUFFER
+from names import NameRegistry, LAYOUTS, FLAT
+from extract import Extractor, archive_of, remove_output
 # ------------------------------------------------------------------------------
 # GLOBALS
 # ------------------------------------------------------------------------------
@@ -32,130 +54,344 @@ __banner__ = r'''
 |____/ \___/ \_/\_/ |_| |_|_|\___/ \__,_|\__,_|\___|_|   v{}
 
 '''.format(__version__)
-URL_QUEUE = Queue()
-PRINT_LOCK = Lock()
-WORKER_TASKS = []
 CHUNK_SIZE = 65536  # 64k
+CONN_LIMIT = 100
+CONN_LIMIT_PER_HOST = 0  # unlimited
+DNS_CACHE_TTL = 10  # seconds
+KEEPALIVE_TIMEOUT = 15  # seconds
+SEGMENTS = 1  # segmented download disabled
+QUEUE_SIZE = 1024
+FAILED_FILENAME = 'failed.url'
 # ------------------------------------------------------------------------------
 # FUNCTIONS
 # ------------------------------------------------------------------------------
-async def log(lvl, msg):
-    '''Display a message
+def worker_log(lvl, msg, worker_id=None):
+    '''Log a worker message
     '''
-    async with PRINT_LOCK:
-        tmstp = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-        print(f"({tmstp})[{lvl}]: {msg}")
+    LOGGER.log(lvl, msg, extra={'worker': worker_id})
 
-async def worker_log(lvl, msg, worker_id=None):
-    '''Display a worker message
+def debug(msg, worker_id=None):
+    '''Log a debug message
     '''
-    if worker_id:
-        msg = f"{worker_id} - {msg}"
-    await log(lvl, msg)
+    worker_log(DEBUG, msg, worker_id)
 
-async def info(msg, worker_id=None):
-    '''Display an information message
+def info(msg, worker_id=None):
+    '''Log an information message
     '''
-    await worker_log('INF', msg, worker_id)
+    worker_log(INFO, msg, worker_id)
 
-async def error(msg, worker_id=None):
-    '''Display an error message
+def warning(msg, worker_id=None):
+    '''Log a warning message
     '''
-    await worker_log('ERR', msg, worker_id)
+    worker_log(WARNING, msg, worker_id)
 
-def filepath_for(url, resp, output_dir):
-    '''[summary]
+def error(msg, worker_id=None):
+    '''Log an error message
+    '''
+    worker_log(ERROR, msg, worker_id)
+
+def filename_for(url, resp):
+    '''Return the name of the file url content shall be stored in
     '''
     content_disp = resp.content_disposition
     if content_disp and content_disp.filename:
-        filename = PurePosixPath(content_disp.filename)
-    else:
-        filename = PurePosixPath(PurePosixPath(URL(url).path).name)
-    filepath = output_dir.joinpath(filename)
-    ctr = 1
-    while filepath.exists():
-        ext = ''.join(filename.suffixes)
-        basename = filename.name.replace(ext, '')
-        filename_candidate = PurePosixPath(f'{basename}.{ctr}{ext}')
-        filepath = output_dir.joinpath(filename_candidate)
-        ctr += 1
-    return filepath
-
-async def download_from_url(url, output_dir):
-    '''Download file from url
-    '''
-    async with ClientSession(raise_for_status=True) as sess:
-        async with sess.get(url) as resp:
-            filepath = filepath_for(url, resp, output_dir)
-            with filepath.open('wb') as fp:
-                while True:
-                    chunk = await resp.content.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    fp.write(chunk)
-    return filepath
-
-async def worker_routine(worker_id, output_dir):
-    '''Represent a monitoring worker
-    '''
-    while True:
-        # get next url out of the queue
-        url = await URL_QUEUE.get()
-        if url is None:
-            await info("exiting gracefully", worker_id)
-            break
-        # download url
-        await info(f"downloading url: {url}", worker_id)
-        try:
-            filepath = await download_from_url(url, output_dir)
-        except Exception as exc:
-            await error(f"an exception occured while downloading '{url}': {exc}", worker_id)
+        return content_disp.filename
+    return URL(url).name
+
+def filepath_for(url, filename, names, is_dir=False):
+    '''Reserve the path of the file (or directory) url content will be
+    stored in
+    '''
+    return names.reserve(names.directory_of(URL(url)), filename, is_dir)
+
+def host_key(url):
+    '''Return the host:port key per-host limits apply to
+    '''
+    return f'{url.host}:{url.port}'
+
+def create_trace_config(scheduler, metrics):
+    '''Create a trace config feeding response latency and errors to scheduler
+    and metrics
+    '''
+    async def on_request_start(session, ctx, params):
+        ctx.start = monotonic()
+
+    async def on_request_end(session, ctx, params):
+        # http errors are reported by on_request_exception as the session
+        # raises for status
+        if params.response.status < 400:
+            ttfb = monotonic() - ctx.start
+            scheduler.success(host_key(params.url), ttfb)
+            metrics.response(host_key(params.url), ttfb)
+
+    async def on_request_exception(session, ctx, params):
+        exc = params.exception
+        if isinstance(exc, ClientResponseError):
+            scheduler.failure(host_key(params.url), exc.status, retry_after(exc.headers or {}))
         else:
-            await info(f"'{url}' content stored in {filepath}", worker_id)
-        # notify the queue that the url has been processed
-        URL_QUEUE.task_done()
+            scheduler.failure(host_key(params.url))
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+def create_session(limit=CONN_LIMIT,
+                   limit_per_host=CONN_LIMIT_PER_HOST,
+                   dns_cache_ttl=DNS_CACHE_TTL,
+                   keepalive_timeout=KEEPALIVE_TIMEOUT,
+                   scheduler=None,
+                   metrics=None,
+                   ca_file=None):
+    '''Create the client session shared by all workers
+
+    A single connection pool is used for the whole run so that TCP+TLS
+    handshakes are amortized over every url sharing a host.
+    '''
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_cache_ttl,
+        use_dns_cache=dns_cache_ttl > 0,
+        keepalive_timeout=keepalive_timeout,
+        ssl=ssl.create_default_context(cafile=ca_file) if ca_file else True,
+    )
+    trace_configs = [create_trace_config(scheduler, metrics or Metrics())] if scheduler else None
+    return ClientSession(connector=connector, raise_for_status=True,
+                         trace_configs=trace_configs)
+
+def resume_offset(entry, filepath):
+    '''Return the number of bytes of a partial download known to be on disk
+
+    Files are preallocated, their size only bounds what was written.
+    '''
+    return min(filepath.stat().st_size, entry.get('written') or 0)
+
+def resume_headers(journal, url):
+    '''Build range request headers to continue a partial download of url
+
+    Return an empty dict when there is nothing to resume or no validator to
+    make sure the remote content did not change since the partial download.
+    '''
+    entry = journal.get(url)
+    filepath = journal.filepath_of(url)
+    if not filepath or not filepath.is_file():
+        return {}
+    # segments are written out of order, there is no single offset
+    if entry.get('segments'):
+        return {}
+    validator = entry.get('etag') or entry.get('last_modified')
+    offset = resume_offset(entry, filepath)
+    if not validator or not offset:
+        return {}
+    # ranges apply to the encoded content, partial file holds decoded bytes
+    return {'Range': f'bytes={offset}-', 'If-Range': validator,
+            'Accept-Encoding': 'identity'}
+
+def content_size(resp, offset):
+    '''Return total size of the remote content or None if unknown
+    '''
+    # content is transparently decoded, its decoded size is unknown
+    if resp.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    if resp.status == 206:
+        content_range = resp.headers.get('Content-Range', '')
+        total = content_range.rpartition('/')[2]
+        if total.isdigit():
+            return int(total)
+        if resp.content_length is not None:
+            return offset + resp.content_length
+        return None
+    return resp.content_length
+
+def plan_segments(url, resp, filepath, journal, segments, segment_threshold, checksum=None):
+    '''Return a segmented download plan if response content can be split
+
+    Content must be large enough, served uncompressed with a validator and the
+    server must accept byte-range requests.
+    '''
+    if segments < 2 or resp.status != 200:
+        return None
+    size = resp.content_length
+    if size is None or size < segment_threshold:
+        return None
+    if resp.headers.get('Accept-Ranges') != 'bytes':
+        return None
+    if resp.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    etag = resp.headers.get('ETag')
+    last_modified = resp.headers.get('Last-Modified')
+    validator = etag or last_modified
+    if not validator:
+        return None
+    # keep segments of a previous run if remote content did not change
+    done = ()
+    entry = journal.get(url) if journal else None
+    if (entry and filepath.is_file()
+            and entry.get('segments') == segments
+            and entry.get('size') == size
+            and entry.get('etag') == etag
+            and entry.get('last_modified') == last_modified):
+        done = entry.get('done_segments', ())
+    return SegmentedDownload(url, filepath, size, validator, segments, done, checksum)
+
+
+async def finalize(url, filepath, hashers, index, checksum=None, extracted=False):
+    '''Check content of a complete download against its expected checksum
+    (algorithm, hexdigest) and deduplicate it
+
+    Extracted content is checked but not deduplicated, hashes are the ones of
+    the downloaded archive.
+    '''
+    if not hashers:
+        return
+    try:
+        index.verify(url, hashers, checksum)
+    except ChecksumError:
+        remove_output(filepath)
+        raise
+    if not extracted:
+        index.deduplicate(filepath, hashers)
+
+def parse_url_line(line):
+    '''Parse a url file line, return (url, checksum) or None for blank lines
+
+    The optional second column is the checksum content is expected to match.
+    '''
+    columns = line.split()
+    if not columns:
+        return None
+    return columns[0], (columns[1] if len(columns) > 1 else None)
 
 def url_from_file(url_file):
-    '''Yield URL from file
+    '''Yield (URL, checksum) from file
     '''
     with url_file.open() as fp:
-        for url in fp:
-            url = url.strip()
-            if not url:
-                continue
-            yield url
+        for line in fp:
+            parsed = parse_url_line(line)
+            if parsed:
+                yield parsed
+
+async def url_from_stdin():
+    '''Yield (URL, checksum) from standard input without blocking the event loop
+    '''
+    mode = fstat(sys.stdin.fileno()).st_mode
+    if not (S_ISFIFO(mode) or S_ISSOCK(mode) or sys.stdin.isatty()):
+        # stdin is a regular file (or alike) which cannot block
+        for parsed in url_from_file(Path('/dev/stdin')):
+            yield parsed
+        return
+    reader = StreamReader()
+    loop = get_running_loop()
+    await loop.connect_read_pipe(lambda: StreamReaderProtocol(reader), sys.stdin)
+    async for line in reader:
+        parsed = parse_url_line(line.decode())
+        if parsed:
+            yield parsed
 
-async def parallel_download(url_file, output_dir, workers=4):
-    '''Perform downloads in parallel using workers
+async def url_from_source(url_file):
+    '''Yield (URL, checksum) from url file or standard input if url file is '-'
     '''
-    for url in url_from_file(args.url_file):
-        await info(f"scheduling url: {url}")
-        await URL_QUEUE.put(url)
-    # check if queue is empty before starting
-    if URL_QUEUE.empty():
-        await error(f"no url to download, exiting.")
+    if str(url_file) == '-':
+        async for parsed in url_from_stdin():
+            yield parsed
         return
-    # create download directory if missing
-    if not output_dir.is_dir():
-        output_dir.mkdir(parents=True)
-    # create N workers to process the queue concurrently
-    await info(f"spawning {workers} workers...")
-    for k in range(workers):
-        WORKER_TASKS.append(create_task(worker_routine(f'worker-{k}', output_dir)))
-    # await queue to be processed entirely
-    await info(f"waiting for urls to be downloaded...")
+    for parsed in url_from_file(url_file):
+        yield parsed
+
+async def url_from_iterable(urls):
+    '''Yield (URL, checksum) from an iterable or async iterable of urls or
+    (url, checksum) tuples
+    '''
+    if not hasattr(urls, '__aiter__'):
+        urls = iterate(urls)
+    async for item in urls:
+        if isinstance(item, (str, URL)):
+            yield str(item), None
+        else:
+            url, checksum = item
+            yield str(url), checksum
+
+async def iterate(iterable):
+    '''Turn an iterable into an async iterable
+    '''
+    for item in iterable:
+        yield item
+
+async def progress_routine(metrics, qsize, interval, metrics_file=None):
+    '''Periodically display a progress line and dump metrics, qsize returns
+    the number of items waiting in queue
+
+    The line is redrawn in place when stderr is a terminal, logged otherwise.
+    '''
     try:
-        await URL_QUEUE.join()
+        while True:
+            await sleep(interval)
+            line = metrics.progress(qsize())
+            if sys.stderr.isatty():
+                sys.stderr.write(f'\r{line}\x1b[K')
+                sys.stderr.flush()
+            else:
+                info(line)
+            if metrics_file:
+                metrics.dump(metrics_file)
     except CancelledError:
-        await error("tasks cancelled.")
-    # terminate workers
-    await info(f"terminating workers...")
-    for _ in WORKER_TASKS:
-        await URL_QUEUE.put(None)
-    # await workers termination
-    await info(f"waiting for workers to terminate...")
-    await gather(*WORKER_TASKS, return_exceptions=True)
-    await info(f"exiting.")
+        if sys.stderr.isatty():
+            sys.stderr.write('\r\x1b[K')
+        raise
+
+def report_run(policy, metrics, output_dir, failed_file=None, metrics_file=None):
+    '''Write the failure report and log the end-of-run summary
+    '''
+    # report urls which could not be downloaded
+    failed_file = failed_file or output_dir.joinpath(FAILED_FILENAME)
+    if policy.failed:
+        policy.write_report(failed_file)
+        error(f"{len(policy.failed)} urls could not be downloaded, see {failed_file}")
+    elif failed_file.is_file():
+        failed_file.unlink()
+    # end-of-run summary
+    for line in metrics.summary():
+        info(line)
+    if metrics_file:
+        metrics.dump(metrics_file)
+    info(f"exiting.")
+
+def host_of(item):
+    '''Return host targeted by a queue item
+    '''
+    if isinstance(item, Segment):
+        return host_key(URL(item.download.url))
+    return host_key(URL(item.url))
+
+async def parallel_download(url_file, output_dir,
+                            failed_file=None,
+                            progress=0,
+                            metrics_file=None,
+                            **options):
+    '''Download urls of url file (or standard input) into output directory,
+    options are those of Downloader
+    '''
+    async with Downloader(output_dir, **options) as downloader:
+        # report progress while downloading
+        progress_task = None
+        if progress:
+            progress_task = create_task(progress_routine(downloader.metrics, downloader.queue.qsize,
+                                                         progress, metrics_file))
+        # stream urls to workers while they download
+        info(f"waiting for urls to be downloaded...")
+        count = 0
+        try:
+            async for _ in downloader.fetch_many(url_from_source(url_file)):
+                count += 1
+            if not count:
+                error(f"no url to download.")
+        except CancelledError:
+            error("tasks cancelled.")
+        if progress_task:
+            progress_task.cancel()
+    report_run(downloader.policy, downloader.metrics, output_dir, failed_file, metrics_file)
 
 def parse_args():
     '''[summary]
@@ -163,16 +399,617 @@ def parse_args():
     parser = ArgumentParser(description="Downloads multiple files using given url file.")
     parser.add_argument('--workers', '-w', type=int, default=4, help="Number of workers.")
     parser.add_argument('--output-dir', '-o', type=Path, default=Path(), help="Directory where files should be placed.")
-    parser.add_argument('url_file', type=Path, help="URL file.")
+    parser.add_argument('--limit', type=int, default=CONN_LIMIT, help="Maximum number of simultaneous connections, 0 means unlimited.")
+    parser.add_argument('--limit-per-host', type=int, default=CONN_LIMIT_PER_HOST, help="Maximum number of simultaneous connections to the same host, 0 means unlimited.")
+    parser.add_argument('--dns-cache-ttl', type=int, default=DNS_CACHE_TTL, help="Seconds DNS resolutions are cached for, 0 disables the cache.")
+    parser.add_argument('--keepalive-timeout', type=float, default=KEEPALIVE_TIMEOUT, help="Seconds an idle connection is kept open for reuse.")
+    parser.add_argument('--resume', '-r', action='store_true', help="Keep a journal in the output directory, skip urls already downloaded and continue partial downloads.")
+    parser.add_argument('--cache', '-c', action='store_true', help="Like --resume but revalidate urls already downloaded using conditional requests, download them again only if they changed.")
+    parser.add_argument('--since', type=parse_since, help="Only download urls never downloaded before if they changed since this ISO 8601 date or the modification time of this file (e.g. previous url file).")
+    parser.add_argument('--segments', '-s', type=int, default=SEGMENTS, help="Split large files into this many byte-range segments downloaded concurrently by workers.")
+    parser.add_argument('--segment-threshold', type=int, default=SEGMENT_THRESHOLD, help="Minimum size in bytes of a file to be downloaded in segments.")
+    parser.add_argument('--rate', type=float, default=RATE, help="Maximum number of requests per second per host, 0 means unlimited.")
+    parser.add_argument('--burst', type=int, default=BURST, help="Number of requests allowed in a burst above --rate.")
+    parser.add_argument('--max-per-host', type=int, default=0, help="Maximum number of concurrent downloads per host, 0 means unlimited.")
+    parser.add_argument('--adaptive', '-a', action='store_true', help="Adapt concurrency per host to latency, errors and throttling responses.")
+    parser.add_argument('--dedup', '-d', action='store_true', help="Hard link files whose content was already downloaded instead of storing it twice.")
+    parser.add_argument('--retries', type=int, default=RETRIES, help="Maximum number of retries of a url after a transient failure.")
+    parser.add_argument('--retry-delay', type=float, default=RETRY_DELAY, help="Base delay in seconds of the exponential backoff between retries.")
+    parser.add_argument('--retry-max-delay', type=float, default=RETRY_MAX_DELAY, help="Maximum delay in seconds between retries.")
+    parser.add_argument('--failed-file', type=Path, help=f"File listing urls which could not be downloaded, defaults to {FAILED_FILENAME} in output directory.")
+    parser.add_argument('--layout', choices=LAYOUTS, default=FLAT, help="Store files directly in the output directory (flat) or below host/path directories mirroring urls (mirror).")
+    parser.add_argument('--extract', '-x', action='store_true', help="Decompress gzip, xz, bzip2 and zstd (if available) content and extract tar archives while downloading instead of storing archives.")
+    parser.add_argument('--write-buffer', type=int, default=WRITE_BUFFER, help="Initial size in bytes of write buffers (doubled after each write), 0 writes synchronously from the event loop.")
+    parser.add_argument('--direct', action='store_true', help="Bypass the page cache (O_DIRECT) when the filesystem supports it.")
+    parser.add_argument('--fsync-every', type=int, default=0, help="Flush files to disk every given number of bytes written and when closed, 0 leaves it to the kernel.")
+    parser.add_argument('--processes', type=int, default=1, help="Shard urls by host across this many processes, each running its own workers and connection pool.")
+    parser.add_argument('--ca-file', type=Path, help="Trust certificates signed by the authorities of this PEM file instead of the system ones.")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="Maximum number of urls read but not processed yet.")
+    parser.add_argument('--progress', '-p', type=float, default=0, help="Display a progress line every given seconds, 0 disables it.")
+    parser.add_argument('--metrics-file', type=Path, help="Dump metrics to this file at the end of the run (and along progress), JSON if it ends with .json, Prometheus text format otherwise.")
+    parser.add_argument('--log-level', choices=list(LEVELS), default='info', help="Minimum level of logged messages.")
+    parser.add_argument('--log-json', action='store_true', help="Log JSON objects, one per line.")
+    parser.add_argument('--quiet', '-q', action='store_true', help="Only log errors.")
+    parser.add_argument('url_file', type=Path, help="URL file, '-' reads urls from standard input. An optional second column gives the expected checksum of the content ([algorithm:]hexdigest).")
     return parser.parse_args()
 # ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+Result = namedtuple('Result', ('url', 'status', 'filepath', 'error', 'checksum'), defaults=(None,))
+
+class Job:
+    '''Occurrence of a url in the queue
+
+    Each occurrence carries the checksum, (algorithm, hexdigest) or None, its
+    content is expected to match so that a url listed several times is
+    verified every time. Without journal, it also keeps the path reserved by
+    its first attempt so that retries overwrite partial content while other
+    occurrences of the url get their own file.
+    '''
+    def __init__(self, url, checksum=None):
+        self.url = url
+        self.checksum = checksum
+        self.filepath = None
+
+    def __str__(self):
+        return self.url
+
+class Downloader:
+    '''Download urls concurrently using workers sharing one session
+
+    A downloader is an async context manager: workers run between enter and
+    exit, urls are submitted with fetch_many (or fetch) which yields a Result
+    per url as soon as it is processed. Several batches can be fetched, one
+    after the other or concurrently.
+
+        async with Downloader(Path('downloads'), workers=8) as downloader:
+            async for result in downloader.fetch_many(urls):
+                ...
+    '''
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    UNCHANGED = 'unchanged'
+
+    def __init__(self, output_dir, workers=4,
+                 limit=CONN_LIMIT,
+                 limit_per_host=CONN_LIMIT_PER_HOST,
+                 dns_cache_ttl=DNS_CACHE_TTL,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 resume=False,
+                 cache=False,
+                 since=None,
+                 segments=SEGMENTS,
+                 segment_threshold=SEGMENT_THRESHOLD,
+                 queue_size=QUEUE_SIZE,
+                 rate=RATE,
+                 burst=BURST,
+                 max_per_host=0,
+                 adaptive=False,
+                 retries=RETRIES,
+                 retry_delay=RETRY_DELAY,
+                 retry_max_delay=RETRY_MAX_DELAY,
+                 dedup=False,
+                 layout=FLAT,
+                 write_buffer=WRITE_BUFFER,
+                 direct=False,
+                 fsync_every=0,
+                 ca_file=None,
+                 extract=False,
+                 shard=None):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.cache = cache
+        self.since = since
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.queue_size = queue_size
+        self.ca_file = ca_file
+        self.extract = extract
+        # index of the process when urls are sharded across processes
+        self.shard = shard
+        self.metrics = Metrics()
+        # journal of previous runs in resume (and cache) mode
+        self.journal = Journal(output_dir) if resume or cache else None
+        # digests of downloaded content
+        self.index = ContentIndex(output_dir, dedup)
+        # transient failures are retried with backoff
+        self.policy = RetryPolicy(retries, retry_delay, retry_max_delay)
+        # per-host rate and concurrency limits
+        self.scheduler = HostScheduler(rate, burst, max_per_host or inf, adaptive)
+        # names of files already in the output directory
+        self.names = NameRegistry(output_dir, layout)
+        # files are written from a thread pool
+        self.open_writer = partial(FileWriter, buffer_size=write_buffer,
+                                   direct=direct, fsync_every=fsync_every)
+        self.queue = None
+        self.slots = None
+        self.session = None
+        self.worker_tasks = []
+        # result queues of the batches waiting for each url
+        self._listeners = defaultdict(deque)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        '''Open the journal and index, create the session and spawn workers
+        '''
+        # create download directory if missing
+        if not self.output_dir.is_dir():
+            self.output_dir.mkdir(parents=True)
+        if self.journal:
+            # a journal shared by processes is compacted before they start
+            self.journal.open(compact=self.shard is None)
+            info(f"resuming using journal: {self.journal.filepath}")
+        if self.cache:
+            info("revalidating urls downloaded by previous runs")
+        self.index.open()
+        self.queue = Queue()
+        # bound the number of urls read but not processed yet, segments are
+        # not counted
+        self.slots = Semaphore(self.queue_size)
+        # one session (and connection pool) shared by every worker
+        self.session = create_session(self.limit, self.limit_per_host,
+                                      self.dns_cache_ttl, self.keepalive_timeout,
+                                      self.scheduler, self.metrics,
+                                      self.ca_file)
+        # create N workers to process the queue concurrently
+        info(f"spawning {self.workers} workers...")
+        prefix = 'worker' if self.shard is None else f'shard-{self.shard}/worker'
+        for k in range(self.workers):
+            self.worker_tasks.append(create_task(self.worker_routine(f'{prefix}-{k}')))
+
+    async def close(self):
+        '''Terminate workers, close the session, the journal and the index
+        '''
+        # terminate workers
+        info(f"terminating workers...")
+        for _ in self.worker_tasks:
+            await self.queue.put(None)
+        # await workers termination
+        info(f"waiting for workers to terminate...")
+        await gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+        await self.session.close()
+        if self.journal:
+            self.journal.close()
+        self.index.close()
+
+    async def fetch_many(self, urls):
+        '''Download urls, yield a Result per url as soon as it is processed
+
+        Urls is an iterable or async iterable of urls or (url, checksum)
+        tuples, it is consumed while downloading.
+        '''
+        results = Queue()
+        producer = create_task(self.producer_routine(urls, results))
+        expected = None
+        received = 0
+        try:
+            while expected is None or received < expected:
+                result = await results.get()
+                # the producer ends the batch with the number of urls it read
+                if isinstance(result, int):
+                    expected = result
+                    continue
+                received += 1
+                yield result
+            # propagate errors of the url source
+            await producer
+        finally:
+            producer.cancel()
+
+    async def fetch(self, url, checksum=None):
+        '''Download a single url, return its Result
+        '''
+        async for result in self.fetch_many([(url, checksum)]):
+            return result
+
+    def report(self, url, status, filepath=None, error=None, checksum=None):
+        '''Send the result of url to the batch waiting for it
+        '''
+        listeners = self._listeners.get(url)
+        if not listeners:
+            return
+        listeners.popleft().put_nowait(Result(url, status, filepath, error, checksum))
+        if not listeners:
+            del self._listeners[url]
+
+    async def producer_routine(self, urls, results):
+        '''Stream urls into the queue, waiting for a free slot before each one
+
+        Put the number of urls read in results once urls are exhausted.
+        '''
+        count = 0
+        try:
+            async for url, checksum in url_from_iterable(urls):
+                self.metrics.scheduled += 1
+                count += 1
+                self._listeners[url].append(results)
+                job = Job(url)
+                if checksum:
+                    try:
+                        job.checksum = parse_checksum(checksum)
+                    except ValueError as exc:
+                        self.metrics.failed += 1
+                        self.policy.give_up(url, exc, checksum)
+                        error(f"invalid checksum for '{url}': {exc}")
+                        self.report(url, Downloader.FAILED, error=exc, checksum=checksum)
+                        continue
+                await self.slots.acquire()
+                debug(f"scheduling url: {url}")
+                await self.queue.put(job)
+        finally:
+            self.metrics.producer_done = True
+            results.put_nowait(count)
+
+    async def read_segment(self, resp, segment):
+        '''Write segment bytes read from resp at their position in the file
+
+        Bytes are gathered and written from the default executor so that disk
+        writes do not block the event loop.
+        '''
+        plan = segment.download
+        host = host_key(URL(plan.url))
+        loop = get_running_loop()
+        offset = segment.start
+        remaining = segment.length
+        buffer = bytearray()
+        while remaining:
+            chunk = await resp.content.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise SegmentError(f"premature end of content for segment {segment}")
+            buffer += chunk
+            self.metrics.add_bytes(host, len(chunk))
+            remaining -= len(chunk)
+            if len(buffer) >= WRITE_BUFFER or not remaining:
+                await loop.run_in_executor(None, plan.write, offset, buffer)
+                offset += len(buffer)
+                buffer = bytearray()
+
+    async def complete_segment(self, segment):
+        '''Mark segment as downloaded, return file path once all segments are
+        '''
+        plan = segment.download
+        plan.complete(segment)
+        if self.journal:
+            self.journal.record(plan.url, done_segments=sorted(plan.done))
+        if not plan.completed:
+            return None
+        plan.verify()
+        plan.close()
+        # segments arrive out of order, content is hashed once assembled
+        algorithms = self.index.algorithms(plan.checksum)
+        if algorithms:
+            hashers = await get_running_loop().run_in_executor(None, hash_file, plan.filepath, algorithms)
+            await finalize(plan.url, plan.filepath, hashers, self.index, plan.checksum)
+        if self.journal:
+            self.journal.record(plan.url, state=Journal.DONE, written=plan.size)
+        return plan.filepath
+
+    async def download_segment(self, segment):
+        '''Download a single segment of a segmented download
+        '''
+        plan = segment.download
+        headers = {
+            'Range': f'bytes={segment.start}-{segment.end}',
+            'If-Range': plan.validator,
+        }
+        async with self.session.get(plan.url, headers=headers) as resp:
+            content_range = resp.headers.get('Content-Range', '')
+            if resp.status != 206 or not content_range.startswith(f'bytes {segment.start}-{segment.end}/'):
+                raise SegmentError(f"range request not honoured for segment {segment}")
+            await self.read_segment(resp, segment)
+        return await self.complete_segment(segment)
+
+    async def start_segmented(self, plan, resp):
+        '''Schedule segments of plan and download the first one from resp
+
+        Return file path if the download is already complete, None otherwise.
+        '''
+        plan.open()
+        if self.journal:
+            self.journal.record(plan.url, state=Journal.PARTIAL,
+                                path=str(plan.filepath.relative_to(self.output_dir)),
+                                size=plan.size,
+                                written=0,
+                                etag=resp.headers.get('ETag'),
+                                last_modified=resp.headers.get('Last-Modified'),
+                                segments=len(plan.segments),
+                                done_segments=sorted(plan.done))
+        first, *others = plan.segments
+        for segment in others:
+            if segment.index not in plan.done:
+                self.queue.put_nowait(segment)
+        try:
+            # first segment is read from the response we already have
+            if first.index not in plan.done:
+                await self.read_segment(resp, first)
+            return await self.complete_segment(first)
+        except:
+            plan.fail()
+            raise
+
+    async def download_from_url(self, job):
+        '''Download file from the url of job
+
+        Return None when the download continues as segments processed by workers.
+        Raise NotModified when a conditional request tells content did not change.
+        '''
+        url = job.url
+        journal = self.journal
+        entry = journal.get(url) if journal else None
+        # urls downloaded by a previous run are only revalidated (cache mode)
+        revalidating = journal is not None and journal.is_done(url)
+        if revalidating:
+            headers = conditional_headers(entry)
+        elif entry:
+            headers = resume_headers(journal, url)
+        else:
+            headers = conditional_headers(None, self.since)
+        async with self.session.get(url, headers=headers) as resp:
+            if resp.status == 304:
+                if revalidating:
+                    # validators may be refreshed along a 304
+                    journal.record(url,
+                                   etag=resp.headers.get('ETag', entry.get('etag')),
+                                   last_modified=resp.headers.get('Last-Modified', entry.get('last_modified')))
+                raise NotModified(headers.get('If-Modified-Since') or headers.get('If-None-Match'))
+            filename = filename_for(url, resp)
+            # archives are decompressed while downloaded, from the start
+            archive = archive_of(filename) if self.extract and resp.status == 200 else None
+            offset = 0
+            filepath = journal.filepath_of(url) if journal else job.filepath
+            if filepath is None:
+                if archive:
+                    filename, _, is_tar = archive
+                    filepath = filepath_for(url, filename, self.names, is_tar)
+                else:
+                    filepath = filepath_for(url, filename, self.names)
+                if not journal:
+                    job.filepath = filepath
+            elif revalidating or archive:
+                # the previous copy may be hard linked to other files (dedup),
+                # new content must not be written through the shared inode
+                remove_output(filepath)
+            elif resp.status == 206:
+                offset = resume_offset(entry, filepath)
+            plan = None
+            if not archive:
+                plan = plan_segments(url, resp, filepath, journal,
+                                     self.segments, self.segment_threshold, job.checksum)
+            if plan:
+                return await self.start_segmented(plan, resp)
+            # content is hashed while it is written, only the part downloaded
+            # by a previous run has to be read back
+            hashers = self.index.hashers(job.checksum)
+            if hashers and offset:
+                hashers = await get_running_loop().run_in_executor(None, hash_file, filepath, list(hashers), offset)
+            if journal:
+                journal.record(url, state=Journal.PARTIAL,
+                               path=str(filepath.relative_to(self.output_dir)),
+                               size=content_size(resp, offset),
+                               written=offset,
+                               etag=resp.headers.get('ETag'),
+                               last_modified=resp.headers.get('Last-Modified'),
+                               segments=None)
+            host = host_key(URL(url))
+            checkpoint = offset + CHECKPOINT_SIZE
+            # writes (and hashing) happen in a thread while the next chunks
+            # are received
+            if archive:
+                writer = Extractor(filepath, archive[1], archive[2], hashers)
+            else:
+                writer = self.open_writer(filepath, offset, content_size(resp, offset), hashers)
+            # extraction cannot be resumed
+            resumable = journal and not archive
+            try:
+                async with writer:
+                    while True:
+                        chunk = await resp.content.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        await writer.write(chunk)
+                        self.metrics.add_bytes(host, len(chunk))
+                        if resumable and writer.written >= checkpoint:
+                            journal.record(url, written=writer.written)
+                            checkpoint = writer.written + CHECKPOINT_SIZE
+            finally:
+                # what is on disk can be resumed even if the download failed
+                if resumable:
+                    journal.record(url, written=writer.written)
+        await finalize(url, filepath, hashers, self.index, job.checksum, bool(archive))
+        if journal:
+            journal.record(url, state=Journal.DONE)
+        return filepath
+
+    async def segment_routine(self, worker_id, segment):
+        '''Download a segment scheduled by another worker
+
+        Return the delay after which segment shall be retried or None.
+        '''
+        plan = segment.download
+        if plan.failed:
+            info(f"dropping segment of failed download: {segment}", worker_id)
+            return None
+        info(f"downloading segment: {segment}", worker_id)
+        try:
+            filepath = await self.download_segment(segment)
+        except Exception as exc:
+            self.metrics.error(host_key(URL(plan.url)))
+            # a checksum mismatch invalidates the whole file, not the segment
+            delay = None if isinstance(exc, ChecksumError) else self.policy.schedule(segment, exc)
+            if delay is not None:
+                self.metrics.retries += 1
+                warning(f"segment '{segment}' failed: {exc}, retrying in {delay:.1f}s "
+                        f"(attempt {self.policy.attempt(segment)}/{self.policy.retries + 1})", worker_id)
+                return delay
+            checksum = format_checksum(plan.checksum)
+            if not plan.failed:
+                self.metrics.failed += 1
+                self.report(plan.url, Downloader.FAILED, error=exc, checksum=checksum)
+            plan.fail()
+            self.policy.give_up(plan.url, exc, checksum)
+            error(f"an exception occured while downloading segment '{segment}': {exc}", worker_id)
+        else:
+            self.policy.succeeded(segment)
+            if filepath:
+                self.metrics.done += 1
+                self.report(plan.url, Downloader.DONE, filepath, checksum=format_checksum(plan.checksum))
+                info(f"'{plan.url}' content stored in {filepath}", worker_id)
+        return None
+
+    async def url_routine(self, worker_id, job):
+        '''Download a url taken out of the queue
+
+        Return the delay after which job shall be retried or None.
+        '''
+        url = job.url
+        checksum = format_checksum(job.checksum)
+        journal = self.journal
+        # skip urls already handled in this run
+        if journal and not journal.acquire(url):
+            self.metrics.skipped += 1
+            self.report(url, Downloader.SKIPPED, journal.filepath_of(url), checksum=checksum)
+            info(f"skipping already scheduled url: {url}", worker_id)
+            return None
+        info(f"downloading url: {url}", worker_id)
+        start = monotonic()
+        try:
+            filepath = await self.download_from_url(job)
+        except NotModified as exc:
+            self.metrics.unchanged += 1
+            self.policy.succeeded(job)
+            self.report(url, Downloader.UNCHANGED, journal.filepath_of(url) if journal else None, checksum=checksum)
+            info(f"'{url}' not modified ({exc})", worker_id)
+        except Exception as exc:
+            self.metrics.error(host_key(URL(url)))
+            delay = self.policy.schedule(job, exc)
+            if delay is not None:
+                self.metrics.retries += 1
+                if journal:
+                    journal.release(url)
+                warning(f"'{url}' failed: {exc}, retrying in {delay:.1f}s "
+                        f"(attempt {self.policy.attempt(job)}/{self.policy.retries + 1})", worker_id)
+                return delay
+            self.metrics.failed += 1
+            self.policy.give_up(url, exc, checksum)
+            self.report(url, Downloader.FAILED, error=exc, checksum=checksum)
+            error(f"an exception occured while downloading '{url}': {exc}", worker_id)
+        else:
+            self.policy.succeeded(job)
+            if filepath:
+                self.metrics.done += 1
+                self.metrics.latency.observe(monotonic() - start)
+                self.report(url, Downloader.DONE, filepath, checksum=checksum)
+                info(f"'{url}' content stored in {filepath}", worker_id)
+            else:
+                info(f"'{url}' split into {self.segments} segments", worker_id)
+        return None
+
+    def requeue(self, item):
+        '''Put back an item taken out of the queue but not processed
+        '''
+        self.queue.put_nowait(item)
+        self.queue.task_done()
+
+    async def worker_routine(self, worker_id):
+        '''Represent a monitoring worker
+        '''
+        loop = get_running_loop()
+        while True:
+            # get next url (or segment) out of the queue
+            item = await self.queue.get()
+            if item is None:
+                info("exiting gracefully", worker_id)
+                break
+            is_url = isinstance(item, Job)
+            # skip urls completed by a previous run unless they are revalidated
+            if is_url and self.journal and not self.cache and self.journal.is_done(item.url):
+                self.metrics.skipped += 1
+                self.slots.release()
+                self.report(item.url, Downloader.SKIPPED, self.journal.filepath_of(item.url),
+                            checksum=format_checksum(item.checksum))
+                info(f"skipping already downloaded url: {item}", worker_id)
+                self.queue.task_done()
+                continue
+            # defer items of hosts which cannot take another request right now
+            host = host_of(item)
+            delay = self.scheduler.admit(host, item)
+            if delay is None:
+                continue
+            if delay:
+                loop.call_later(delay, self.requeue, item)
+                continue
+            self.metrics.active += 1
+            if is_url:
+                delay = await self.url_routine(worker_id, item)
+            else:
+                delay = await self.segment_routine(worker_id, item)
+            self.metrics.active -= 1
+            # wake up items deferred until a request of this host ends
+            for deferred in self.scheduler.release(host):
+                self.requeue(deferred)
+            # retry later without blocking the worker, item stays accounted in
+            # the queue (and keeps its slot) until then
+            if delay is not None:
+                loop.call_later(delay, self.requeue, item)
+                continue
+            if is_url:
+                # let the producer schedule another url
+                self.slots.release()
+            # notify the queue that the item has been processed
+            self.queue.task_done()
+# ------------------------------------------------------------------------------
 # SCRIPT
 # ------------------------------------------------------------------------------
 if __name__ == '__main__':
-    print(__banner__)
     args = parse_args()
-    loop = get_event_loop()
-    loop.run_until_complete(parallel_download(args.url_file,
-                                              args.output_dir,
-                                              args.workers))
-    loop.close()
+    if not (args.quiet or args.log_json):
+        print(__banner__)
+    listener = setup_logging(args.log_level, args.log_json, args.quiet)
+    main = parallel_download
+    if args.processes > 1:
+        # imported here as it imports this module
+        from processes import sharded_download
+        main = partial(sharded_download, processes=args.processes)
+    run(main(args.url_file,
+             args.output_dir,
+             args.failed_file,
+             args.progress,
+             args.metrics_file,
+             workers=args.workers,
+             limit=args.limit,
+             limit_per_host=args.limit_per_host,
+             dns_cache_ttl=args.dns_cache_ttl,
+             keepalive_timeout=args.keepalive_timeout,
+             resume=args.resume,
+             cache=args.cache,
+             since=args.since,
+             segments=args.segments,
+             segment_threshold=args.segment_threshold,
+             queue_size=args.queue_size,
+             rate=args.rate,
+             burst=args.burst,
+             max_per_host=args.max_per_host,
+             adaptive=args.adaptive,
+             retries=args.retries,
+             retry_delay=args.retry_delay,
+             retry_max_delay=args.retry_max_delay,
+             dedup=args.dedup,
+             layout=args.layout,
+             write_buffer=args.write_buffer,
+             direct=args.direct,
+             fsync_every=args.fsync_every,
+             ca_file=args.ca_file,
+             extract=args.extract))
+    listener.stop()
@@ -0,0 +1,248 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import bz2
+import lzma
+import zlib
+import tarfile
+import posixpath
+from queue import Queue, Full, Empty
+from shutil import rmtree
+from pathlib import PurePosixPath
+from asyncio import get_running_loop
+try:
+    # python 3.14+
+    from compression.zstd import ZstdDecompressor
+except ImportError:
+    try:
+        from zstandard import ZstdDecompressor as _ZstdDecompressor
+        def ZstdDecompressor():
+            return _ZstdDecompressor().decompressobj()
+    except ImportError:
+        ZstdDecompressor = None
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+DECOMPRESSORS = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'xz': lzma.LZMADecompressor,
+    'bzip2': bz2.BZ2Decompressor,
+}
+if ZstdDecompressor:
+    DECOMPRESSORS['zstd'] = ZstdDecompressor
+SUFFIXES = {
+    '.gz': ('gzip', False),
+    '.xz': ('xz', False),
+    '.bz2': ('bzip2', False),
+    '.zst': ('zstd', False),
+    '.tar': (None, True),
+    '.tgz': ('gzip', True),
+    '.txz': ('xz', True),
+    '.tbz2': ('bzip2', True),
+    '.tzst': ('zstd', True),
+}
+QUEUE_DEPTH = 64  # chunks waiting for the extraction thread
+END = object()
+ABORT = object()
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def archive_of(filename):
+    '''Return (output name, compression, is tar) if content named filename can
+    be decompressed or extracted while downloaded, None otherwise
+    '''
+    path = PurePosixPath(filename)
+    compression, is_tar = SUFFIXES.get(path.suffix.lower(), (None, False))
+    if not (compression or is_tar):
+        return None
+    if compression and compression not in DECOMPRESSORS:
+        # optional dependency missing
+        return None
+    name = path.stem
+    if not is_tar and name.lower().endswith('.tar'):
+        is_tar = True
+        name = name[:-len('.tar')]
+    return name, compression, is_tar
+
+def safe_members(archive):
+    '''Yield regular members (files and directories) of a tar archive,
+    raise TarError for members which would be extracted outside of the
+    destination directory
+
+    Used when tarfile has no extraction filters (older python releases),
+    links and special files are skipped, special mode bits are cleared.
+    '''
+    for member in archive:
+        if not (member.isfile() or member.isdir()):
+            continue
+        name = posixpath.normpath(member.name)
+        if name.startswith('/') or '..' in PurePosixPath(name).parts:
+            raise tarfile.TarError(f"unsafe archive member: {member.name}")
+        member.name = name
+        member.mode &= 0o755
+        yield member
+
+def remove_output(path):
+    '''Remove a file or a directory tree
+    '''
+    if path.is_dir() and not path.is_symlink():
+        rmtree(path)
+    elif path.exists():
+        path.unlink()
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class Decompressor:
+    '''Incremental decompressor accepting concatenated streams (e.g. multi
+    member gzip files)
+    '''
+    def __init__(self, compression):
+        self.factory = DECOMPRESSORS[compression] if compression else None
+        self._decompressor = self.factory() if self.factory else None
+        self.truncated = False
+
+    def decompress(self, data):
+        if not self._decompressor:
+            return data
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            self.truncated = not getattr(self._decompressor, 'eof', False)
+            if self.truncated:
+                break
+            # another stream may follow
+            data = self._decompressor.unused_data
+            self._decompressor = self.factory()
+        return b''.join(output)
+
+class ChunkReader:
+    '''Read-only file object over the chunks of a queue, decompressing them
+
+    Compressed chunks are hashed as they are read.
+    '''
+    def __init__(self, queue, decompressor, hashers):
+        self.queue = queue
+        self.decompressor = decompressor
+        self.hashers = hashers
+        self.consumed = 0
+        self._buffer = bytearray()
+        self.ended = False
+
+    def _fill(self):
+        chunk = self.queue.get()
+        if chunk is ABORT:
+            self.ended = True
+            raise EOFError("download aborted")
+        if chunk is END:
+            self.ended = True
+            if self.decompressor.truncated:
+                raise EOFError("compressed stream ended before the end marker")
+            return
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+        self.consumed += len(chunk)
+        self._buffer += self.decompressor.decompress(chunk)
+
+    def read(self, size=-1):
+        while not self.ended and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def drain(self):
+        '''Consume remaining chunks, e.g. padding after the end of a tar archive
+        '''
+        while not self.ended:
+            self._fill()
+        self._buffer.clear()
+
+class Extractor:
+    '''Decompress content (and extract tar members) while it is downloaded
+
+    Chunks are handed over to a thread of the default executor through a
+    bounded queue so that data touches the disk once, decompressed. The
+    interface is the one of FileWriter: written counts compressed bytes.
+    Output is removed if the download fails.
+    '''
+    def __init__(self, filepath, compression, is_tar, hashers=None):
+        self.filepath = filepath
+        self.is_tar = is_tar
+        self.hashers = hashers or {}
+        self.written = 0
+        self._queue = Queue(QUEUE_DEPTH)
+        self._reader = ChunkReader(self._queue, Decompressor(compression), self.hashers)
+        self._task = None
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(abort=exc_type is not None)
+
+    def _run(self):
+        try:
+            self._extract()
+        except:
+            # keep consuming chunks so that the event loop never waits for a
+            # dead thread
+            while not self._reader.ended and self._queue.get() not in (END, ABORT):
+                pass
+            raise
+
+    def _extract(self):
+        if self.is_tar:
+            with tarfile.open(fileobj=self._reader, mode='r|') as archive:
+                if hasattr(tarfile, 'data_filter'):
+                    archive.extractall(self.filepath, filter='data')
+                else:
+                    archive.extractall(self.filepath, members=safe_members(archive))
+            self._reader.drain()
+            return
+        with self.filepath.open('wb') as fp:
+            while True:
+                data = self._reader.read(1024 * 1024)
+                if not data:
+                    break
+                fp.write(data)
+
+    def open(self):
+        self._task = get_running_loop().run_in_executor(None, self._run)
+
+    async def write(self, chunk):
+        try:
+            self._queue.put_nowait(chunk)
+        except Full:
+            # extraction is late, wait for it without blocking the loop
+            await get_running_loop().run_in_executor(None, self._queue.put, chunk)
+        self.written += len(chunk)
+
+    async def close(self, abort=False):
+        '''Wait for extraction to complete, stop it and remove output if abort
+        '''
+        if abort:
+            # unblock the thread, whatever it is waiting for
+            while True:
+                try:
+                    self._queue.put_nowait(ABORT)
+                    break
+                except Full:
+                    try:
+                        self._queue.get_nowait()
+                    except Empty:
+                        pass
+        else:
+            await get_running_loop().run_in_executor(None, self._queue.put, END)
+        try:
+            await self._task
+        except Exception:
+            remove_output(self.filepath)
+            if not abort:
+                raise
+        else:
+            if abort:
+                remove_output(self.filepath)
@@ -0,0 +1,110 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from json import dumps, loads
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+JOURNAL_FILENAME = '.downloader.journal'
+CHECKPOINT_SIZE = 16 * 1024 * 1024  # 16M
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class Journal:
+    '''Persistent per-url download state stored in the output directory
+
+    The journal is an append-only JSON-lines file, the last record of a url
+    wins. It is compacted when opened so that it does not grow across runs.
+    '''
+    PARTIAL = 'partial'
+    DONE = 'done'
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.filepath = output_dir.joinpath(JOURNAL_FILENAME)
+        self.entries = {}
+        self.active = set()
+        self._fp = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load(self):
+        if not self.filepath.is_file():
+            return
+        with self.filepath.open() as fp:
+            for line in fp:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    # last line may be truncated if we crashed while writing
+                    continue
+                self.entries.setdefault(record['url'], {}).update(record)
+
+    def open(self, compact=True):
+        '''Load previous state, compact the journal and open it for appending
+
+        Processes sharing the journal must not compact it, each record is
+        appended with a single write.
+        '''
+        self._load()
+        if compact:
+            tmp = self.filepath.with_suffix('.tmp')
+            with tmp.open('w') as fp:
+                for entry in self.entries.values():
+                    fp.write(dumps(entry) + '\n')
+            tmp.replace(self.filepath)
+        self._fp = self.filepath.open('a')
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def get(self, url):
+        '''Return journal entry of url or None
+        '''
+        return self.entries.get(url)
+
+    def filepath_of(self, url):
+        '''Return path of the file url content is stored in, None if unknown
+        '''
+        entry = self.entries.get(url)
+        if entry and entry.get('path'):
+            return self.output_dir.joinpath(entry['path'])
+        return None
+
+    def is_done(self, url):
+        '''Determine if url was entirely downloaded and its file (or directory
+        it was extracted to) still exists
+        '''
+        entry = self.entries.get(url)
+        if not entry or entry.get('state') != Journal.DONE:
+            return False
+        return self.filepath_of(url).exists()
+
+    def acquire(self, url):
+        '''Mark url as being processed in this run, return False if it already is
+        '''
+        if url in self.active:
+            return False
+        self.active.add(url)
+        return True
+
+    def release(self, url):
+        '''Allow url to be processed again in this run, e.g. to retry it
+        '''
+        self.active.discard(url)
+
+    def record(self, url, **fields):
+        '''Update url entry and persist the change immediately
+        '''
+        entry = self.entries.setdefault(url, {'url': url})
+        entry.update(fields)
+        self._fp.write(dumps(entry) + '\n')
+        self._fp.flush()
@@ -0,0 +1,109 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import sys
+from json import dumps
+from queue import SimpleQueue
+from logging import (
+    DEBUG,
+    INFO,
+    WARNING,
+    ERROR,
+    Formatter,
+    StreamHandler,
+    getLogger,
+)
+from logging.handlers import QueueHandler, QueueListener
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+LOGGER = getLogger('downloader')
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+SHORT_LEVEL_NAMES = {
+    DEBUG: 'DBG',
+    INFO: 'INF',
+    WARNING: 'WRN',
+    ERROR: 'ERR',
+}
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class TextFormatter(Formatter):
+    '''Format records as "(timestamp)[LVL]: worker - message"
+    '''
+    def __init__(self):
+        super().__init__(datefmt=TIME_FORMAT)
+
+    def format(self, record):
+        tmstp = self.formatTime(record, self.datefmt)
+        lvl = SHORT_LEVEL_NAMES.get(record.levelno, record.levelname)
+        msg = record.getMessage()
+        worker = getattr(record, 'worker', None)
+        if worker:
+            msg = f"{worker} - {msg}"
+        return f"({tmstp})[{lvl}]: {msg}"
+
+class JSONFormatter(Formatter):
+    '''Format records as JSON objects, one per line
+    '''
+    def __init__(self):
+        super().__init__(datefmt=TIME_FORMAT)
+
+    def format(self, record):
+        obj = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname.lower(),
+            'message': record.getMessage(),
+        }
+        worker = getattr(record, 'worker', None)
+        if worker:
+            obj['worker'] = worker
+        return dumps(obj)
+
+class DeferredFormatHandler(QueueHandler):
+    '''Queue handler leaving formatting to the listener thread
+    '''
+    def prepare(self, record):
+        # args are merged so that records never hold references to mutable
+        # objects which could change before the listener formats them
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def setup_logging(level='info', json_lines=False, quiet=False):
+    '''Route downloader logs through a queue drained by a listener thread
+
+    Emitting a record only enqueues it, formatting and writing to stdout
+    happen in the listener thread so the event loop never blocks on output.
+    Return the started listener, it must be stopped to flush pending records.
+    '''
+    handler = StreamHandler(sys.stdout)
+    handler.setFormatter(JSONFormatter() if json_lines else TextFormatter())
+    queue = SimpleQueue()
+    LOGGER.addHandler(DeferredFormatHandler(queue))
+    LOGGER.setLevel(ERROR if quiet else LEVELS[level])
+    LOGGER.propagate = False
+    listener = QueueListener(queue, handler)
+    listener.start()
+    return listener
+
+def forward_logging(queue, level):
+    '''Route downloader logs to queue without formatting them, e.g. to the
+    process which started this one
+
+    Level is the numeric level of the receiving logger.
+    '''
+    LOGGER.handlers.clear()
+    LOGGER.addHandler(DeferredFormatHandler(queue))
+    LOGGER.setLevel(level)
+    LOGGER.propagate = False
@@ -0,0 +1,248 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from json import dumps
+from math import inf
+from time import monotonic
+from bisect import bisect_left
+from collections import defaultdict
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, inf)
+UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def human_size(size):
+    '''Format a number of bytes using binary units
+    '''
+    for unit in UNITS[:-1]:
+        if size < 1024:
+            return f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}{UNITS[-1]}'
+
+def human_duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class Histogram:
+    '''Histogram with fixed cumulative-friendly buckets (Prometheus style)
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        '''Return the upper bound of the bucket holding quantile q
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return inf
+
+    def merge(self, other):
+        for k, count in enumerate(other.counts):
+            self.counts[k] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+class HostMetrics:
+    __slots__ = ('bytes', 'requests', 'errors')
+
+    def __init__(self):
+        self.bytes = 0
+        self.requests = 0
+        self.errors = 0
+
+class Metrics:
+    '''Counters and histograms of a downloader run
+    '''
+    def __init__(self):
+        self.started = monotonic()
+        self.bytes = 0
+        self.scheduled = 0
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.retries = 0
+        self.active = 0
+        self.producer_done = False
+        self.hosts = defaultdict(HostMetrics)
+        self.ttfb = Histogram()
+        self.latency = Histogram()
+        self._last_bytes = 0
+        self._last_time = self.started
+
+    def aggregate(self, snapshots):
+        '''Replace counters and histograms by the sum of snapshots, e.g. the
+        metrics of several processes
+
+        Start time and producer state are kept.
+        '''
+        self.bytes = self.scheduled = self.done = self.failed = 0
+        self.skipped = self.unchanged = self.retries = self.active = 0
+        self.hosts = defaultdict(HostMetrics)
+        self.ttfb = Histogram()
+        self.latency = Histogram()
+        for snapshot in snapshots:
+            for attr in ('bytes', 'scheduled', 'done', 'failed', 'skipped',
+                         'unchanged', 'retries', 'active'):
+                setattr(self, attr, getattr(self, attr) + getattr(snapshot, attr))
+            for host, hm in snapshot.hosts.items():
+                total = self.hosts[host]
+                total.bytes += hm.bytes
+                total.requests += hm.requests
+                total.errors += hm.errors
+            self.ttfb.merge(snapshot.ttfb)
+            self.latency.merge(snapshot.latency)
+
+    def add_bytes(self, host, size):
+        self.bytes += size
+        self.hosts[host].bytes += size
+
+    def response(self, host, ttfb):
+        self.hosts[host].requests += 1
+        self.ttfb.observe(ttfb)
+
+    def error(self, host):
+        self.hosts[host].errors += 1
+
+    @property
+    def finished(self):
+        return self.done + self.failed + self.skipped + self.unchanged
+
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def eta(self, rate):
+        '''Return estimated seconds before all urls are processed, None when
+        unknown (urls still being read or nothing finished yet)
+        '''
+        if not self.producer_done or not rate:
+            return None
+        return (self.scheduled - self.finished) / rate
+
+    def progress(self, qsize):
+        '''Return a single-line progress report, throughput is measured since
+        the previous call
+        '''
+        now = monotonic()
+        throughput = (self.bytes - self._last_bytes) / max(now - self._last_time, 1e-6)
+        self._last_bytes, self._last_time = self.bytes, now
+        eta = self.eta(self.finished / max(now - self.started, 1e-6))
+        return (f"{human_size(throughput)}/s | {human_size(self.bytes)} | "
+                f"{self.finished}/{self.scheduled}{'' if self.producer_done else '+'} urls | "
+                f"{self.failed} failed | {self.active} active | queue {qsize} | "
+                f"ETA {human_duration(eta) if eta is not None else '--:--:--'}")
+
+    def summary(self):
+        '''Return end-of-run summary lines
+        '''
+        elapsed = self.elapsed()
+        return [
+            f"{self.done} urls downloaded, {self.failed} failed, {self.skipped} skipped, "
+            f"{self.unchanged} unchanged, {self.retries} retries in {human_duration(elapsed)}",
+            f"{human_size(self.bytes)} received at {human_size(self.bytes / max(elapsed, 1e-6))}/s",
+            f"time to first byte p50={self.ttfb.quantile(0.5)}s p95={self.ttfb.quantile(0.95)}s, "
+            f"url latency p50={self.latency.quantile(0.5)}s p95={self.latency.quantile(0.95)}s",
+        ] + [
+            f"{host}: {human_size(hm.bytes)}, {hm.requests} responses, {hm.errors} errors"
+            for host, hm in sorted(self.hosts.items())
+        ]
+
+    def to_dict(self):
+        return {
+            'elapsed_seconds': self.elapsed(),
+            'bytes': self.bytes,
+            'urls': {
+                'scheduled': self.scheduled,
+                'done': self.done,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'unchanged': self.unchanged,
+                'retries': self.retries,
+                'active': self.active,
+            },
+            'ttfb_seconds': self._histogram_dict(self.ttfb),
+            'latency_seconds': self._histogram_dict(self.latency),
+            'hosts': {
+                host: {'bytes': hm.bytes, 'requests': hm.requests, 'errors': hm.errors}
+                for host, hm in self.hosts.items()
+            },
+        }
+
+    @staticmethod
+    def _histogram_dict(histogram):
+        return {
+            'count': histogram.count,
+            'sum': histogram.sum,
+            'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+        }
+
+    def to_json(self):
+        return dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        '''Return metrics in Prometheus text exposition format
+        '''
+        lines = [
+            '# TYPE downloader_bytes_total counter',
+            f'downloader_bytes_total {self.bytes}',
+            '# TYPE downloader_urls_total counter',
+        ]
+        for state in ('scheduled', 'done', 'failed', 'skipped', 'unchanged'):
+            lines.append(f'downloader_urls_total{{state="{state}"}} {getattr(self, state)}')
+        lines += [
+            '# TYPE downloader_retries_total counter',
+            f'downloader_retries_total {self.retries}',
+            '# TYPE downloader_active_downloads gauge',
+            f'downloader_active_downloads {self.active}',
+        ]
+        for name, histogram in (('ttfb', self.ttfb), ('latency', self.latency)):
+            metric = f'downloader_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == inf else bound
+                lines.append(f'{metric}_bucket{{le="{le}"}} {count}')
+            lines.append(f'{metric}_sum {histogram.sum}')
+            lines.append(f'{metric}_count {histogram.count}')
+        for metric, attr in (('host_bytes_total', 'bytes'),
+                             ('host_requests_total', 'requests'),
+                             ('host_errors_total', 'errors')):
+            lines.append(f'# TYPE downloader_{metric} counter')
+            for host, hm in sorted(self.hosts.items()):
+                lines.append(f'downloader_{metric}{{host="{host}"}} {getattr(hm, attr)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filepath):
+        '''Write metrics to filepath, JSON if its suffix is .json, Prometheus
+        text format otherwise
+        '''
+        content = self.to_json() if filepath.suffix == '.json' else self.to_prometheus()
+        tmp = filepath.with_name(f'.{filepath.name}.tmp')
+        tmp.write_text(content)
+        tmp.replace(filepath)
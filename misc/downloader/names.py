@@ -0,0 +1,89 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import os
+from pathlib import PurePosixPath
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+FLAT = 'flat'
+MIRROR = 'mirror'
+LAYOUTS = (FLAT, MIRROR)
+DEFAULT_FILENAME = 'index.html'
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class NameRegistry:
+    '''Names of the files of the output directory
+
+    Each directory is scanned once, the first time a name is reserved in it,
+    then names are reserved in memory. A reserved name is created with O_EXCL
+    so that concurrent processes sharing the directory never pick the same
+    name. The next suffix to try is remembered per name so that many urls
+    sharing a name do not probe every previous candidate.
+
+    Files are stored directly in the output directory (flat layout) or below
+    host/path directories mirroring urls (mirror layout).
+    '''
+    def __init__(self, output_dir, layout=FLAT):
+        self.output_dir = output_dir
+        self.layout = layout
+        self.names = {}
+        self.counters = {}
+
+    def _names(self, directory):
+        names = self.names.get(directory)
+        if names is None:
+            directory.mkdir(parents=True, exist_ok=True)
+            with os.scandir(directory) as entries:
+                names = {entry.name for entry in entries}
+            self.names[directory] = names
+        return names
+
+    def directory_of(self, url):
+        '''Return the directory url content shall be stored in
+        '''
+        if self.layout == FLAT:
+            return self.output_dir
+        host = url.host if url.is_default_port() else f'{url.host}_{url.port}'
+        # yarl normalizes dot segments before decoding, a decoded %2F may
+        # still produce empty, . or .. parts which are dropped
+        parts = url.path.split('/')
+        if not url.path.endswith('/'):
+            parts.pop()
+        parts = [part for part in parts if part not in ('', '.', '..')]
+        directory = self.output_dir.joinpath(host, *parts)
+        if not directory.resolve().is_relative_to(self.output_dir.resolve()):
+            raise ValueError(f'{url} would be stored outside of the output directory')
+        return directory
+
+    def reserve(self, directory, filename, is_dir=False):
+        '''Create an empty file (or directory) named after filename in
+        directory, adding a counter before its extensions if the name is
+        taken, return its path
+        '''
+        names = self._names(directory)
+        filename = PurePosixPath(filename).name or DEFAULT_FILENAME
+        ext = ''.join(PurePosixPath(filename).suffixes)
+        basename = filename.replace(ext, '')
+        key = (directory, filename)
+        ctr = self.counters.get(key, 1)
+        candidate = filename
+        while True:
+            if candidate not in names:
+                names.add(candidate)
+                filepath = directory.joinpath(candidate)
+                try:
+                    if is_dir:
+                        os.mkdir(filepath)
+                    else:
+                        os.close(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+                except FileExistsError:
+                    # created by another process since the scan
+                    pass
+                else:
+                    self.counters[key] = ctr
+                    return filepath
+            candidate = f'{basename}.{ctr}{ext}'
+            ctr += 1
@@ -0,0 +1,288 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from copy import deepcopy
+from zlib import crc32
+from time import monotonic
+from queue import Empty, Full
+from functools import partial
+from asyncio import CancelledError, get_running_loop, create_task, ensure_future, run, sleep, wait
+from multiprocessing import get_context
+from logging.handlers import QueueListener
+from yarl import URL
+from logs import LOGGER, forward_logging
+from metrics import Metrics
+from journal import Journal
+from retry import RetryPolicy
+from dedup import parse_checksum, format_checksum
+from downloader import (
+    Downloader,
+    QUEUE_SIZE,
+    host_key,
+    info,
+    error,
+    url_from_source,
+    progress_routine,
+    report_run,
+)
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+URL_BATCH = 16  # urls sent to a process at once
+BATCH_DELAY = 0.1  # seconds a partial batch may wait for more urls
+METRICS_INTERVAL = 1.0  # seconds between metrics snapshots of processes
+PROCESS_POLL = 1.0  # seconds between checks of processes which may have died
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def shard_of(url, processes):
+    '''Return the index of the process url is assigned to
+
+    Urls of a host always go to the same process so that per-host limits and
+    connection reuse keep working.
+    '''
+    return crc32(host_key(URL(url)).encode()) % processes
+
+def reported_checksum(checksum):
+    '''Return checksum as results report it, 'algorithm:hexdigest' once
+    parsed
+    '''
+    if not checksum:
+        return None
+    try:
+        return format_checksum(parse_checksum(checksum))
+    except ValueError:
+        return checksum
+
+async def url_from_queue(queue):
+    '''Yield (URL, checksum) from batches put in a multiprocessing queue until
+    None is received
+    '''
+    loop = get_running_loop()
+    while True:
+        batch = await loop.run_in_executor(None, queue.get)
+        if batch is None:
+            return
+        for parsed in batch:
+            yield parsed
+
+async def metrics_routine(shard, metrics, results):
+    '''Periodically send a metrics snapshot to the coordinator
+    '''
+    while True:
+        # queued objects are pickled later by a feeder thread, metrics must
+        # not change meanwhile
+        results.put(('metrics', shard, deepcopy(metrics)))
+        await sleep(METRICS_INTERVAL)
+
+async def shard_download(shard, output_dir, urls, results, options):
+    '''Download urls received by this process, send results and metrics back
+
+    Return final metrics.
+    '''
+    async with Downloader(output_dir, shard=shard, **options) as downloader:
+        reporter = create_task(metrics_routine(shard, downloader.metrics, results))
+        async for result in downloader.fetch_many(url_from_queue(urls)):
+            # exceptions do not always survive pickling
+            result = result._replace(filepath=result.filepath and str(result.filepath),
+                                     error=result.error and str(result.error))
+            results.put(('result', shard, result))
+        reporter.cancel()
+    return downloader.metrics
+
+def shard_main(shard, output_dir, urls, results, logs, log_level, options):
+    '''Entry point of a download process
+    '''
+    forward_logging(logs, log_level)
+    metrics = Metrics()
+    try:
+        metrics = run(shard_download(shard, output_dir, urls, results, options))
+    finally:
+        # the coordinator waits for every process to be done
+        results.put(('done', shard, metrics))
+
+async def sharded_download(url_file, output_dir,
+                           failed_file=None,
+                           progress=0,
+                           metrics_file=None,
+                           processes=2,
+                           **options):
+    '''Download urls of url file (or standard input) into output directory
+    using several processes, options are those of Downloader
+
+    The coordinator reads urls and dispatches them by host, download
+    processes send back results, metrics snapshots and log records.
+    '''
+    loop = get_running_loop()
+    if not output_dir.is_dir():
+        output_dir.mkdir(parents=True)
+    # processes append to the journal, it is compacted once beforehand
+    if options.get('resume') or options.get('cache'):
+        with Journal(output_dir):
+            pass
+    context = get_context('spawn')
+    # a slot of a process queue holds a batch of urls
+    queue_size = max(1, options.get('queue_size', QUEUE_SIZE) // URL_BATCH)
+    url_queues = [context.Queue(queue_size) for _ in range(processes)]
+    results = context.Queue()
+    # log records of processes are handled by the logger of this process
+    logs = context.Queue()
+    log_listener = QueueListener(logs, LOGGER)
+    log_listener.start()
+    info(f"spawning {processes} processes...")
+    procs = [
+        context.Process(target=shard_main,
+                        args=(k, output_dir, url_queues[k], results, logs,
+                              LOGGER.getEffectiveLevel(), options))
+        for k in range(processes)
+    ]
+    for proc in procs:
+        proc.start()
+    metrics = Metrics()
+    snapshots = {}
+    policy = RetryPolicy()
+    # url: (process, checksums of its occurrences) of urls dispatched without
+    # result yet, occurrences of a url all go to the same process
+    pending = {}
+    # processes which exited without sending their final metrics
+    dead = set()
+    lost = 0
+
+    def settle(url, checksum):
+        # remove an occurrence of url from pending, return False if none is
+        entry = pending.get(url)
+        if entry is None:
+            return False
+        checksums = entry[1]
+        checksums.remove(checksum if checksum in checksums else checksums[0])
+        if not checksums:
+            del pending[url]
+        return True
+
+    def abandon(occurrences, shard):
+        # (url, checksum) occurrences of a dead process are reported as failed
+        nonlocal lost
+        for url, checksum in occurrences:
+            if settle(url, checksum):
+                policy.give_up(url, f"process {shard} exited", checksum)
+                metrics.failed += 1
+                lost += 1
+
+    def bury(shard):
+        dead.add(shard)
+        error(f"process {shard} exited unexpectedly (exit code {procs[shard].exitcode})")
+        # nobody reads its queue anymore, do not wait for it to be flushed
+        url_queues[shard].cancel_join_thread()
+        abandon([(url, checksum) for url, (k, checksums) in list(pending.items())
+                 if k == shard for checksum in list(checksums)], shard)
+
+    async def collect():
+        running = set(range(processes))
+        while running:
+            # a process dead before waiting has sent everything it ever will
+            exited = [k for k in running if not procs[k].is_alive()]
+            try:
+                kind, shard, payload = await loop.run_in_executor(None, partial(results.get, True, PROCESS_POLL))
+            except Empty:
+                for k in exited:
+                    running.discard(k)
+                    bury(k)
+                continue
+            if kind == 'result':
+                settle(payload.url, payload.checksum)
+                if payload.status == Downloader.FAILED:
+                    policy.give_up(payload.url, payload.error, payload.checksum)
+                continue
+            snapshots[shard] = payload
+            metrics.aggregate(snapshots.values())
+            metrics.failed += lost
+            if kind == 'done':
+                running.discard(shard)
+
+    async def send(k, item):
+        # return False if process k died instead of taking item
+        while procs[k].is_alive():
+            try:
+                await loop.run_in_executor(None, partial(url_queues[k].put, item, True, PROCESS_POLL))
+                return True
+            except Full:
+                pass
+        return False
+
+    async def dispatch():
+        batches = [[] for _ in range(processes)]
+        # time the first url of each partial batch was read at
+        started = [None] * processes
+
+        async def flush(k):
+            batch, batches[k], started[k] = batches[k], [], None
+            if k in dead or not await send(k, batch):
+                abandon([(url, reported_checksum(checksum)) for url, checksum in batch], k)
+
+        source = url_from_source(url_file)
+        next_url = None
+        try:
+            while True:
+                if next_url is None:
+                    next_url = ensure_future(source.__anext__())
+                # partial batches are sent once they waited BATCH_DELAY, even
+                # if no other url is read meanwhile
+                deadlines = [t + BATCH_DELAY for t in started if t is not None]
+                timeout = max(0, min(deadlines) - monotonic()) if deadlines else None
+                await wait((next_url,), timeout=timeout)
+                now = monotonic()
+                for k, t in enumerate(started):
+                    if t is not None and now - t >= BATCH_DELAY:
+                        await flush(k)
+                if not next_url.done():
+                    continue
+                try:
+                    parsed = next_url.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_url = None
+                k = shard_of(parsed[0], processes)
+                pending.setdefault(parsed[0], (k, []))[1].append(reported_checksum(parsed[1]))
+                if not batches[k]:
+                    started[k] = monotonic()
+                batches[k].append(parsed)
+                if len(batches[k]) >= URL_BATCH:
+                    await flush(k)
+        finally:
+            if next_url is not None:
+                next_url.cancel()
+            # processes wait for the end of their urls, even if reading urls
+            # failed
+            for k in range(processes):
+                if batches[k]:
+                    await flush(k)
+                if k not in dead:
+                    await send(k, None)
+            metrics.producer_done = True
+
+    collector = create_task(collect())
+    progress_task = None
+    if progress:
+        def qsize():
+            return sum(queue.qsize() for queue in url_queues) * URL_BATCH
+        progress_task = create_task(progress_routine(metrics, qsize, progress, metrics_file))
+    info(f"waiting for urls to be downloaded...")
+    try:
+        try:
+            await dispatch()
+        finally:
+            await collector
+        if not metrics.scheduled:
+            error(f"no url to download.")
+    except CancelledError:
+        error("tasks cancelled.")
+    finally:
+        if progress_task:
+            progress_task.cancel()
+        info(f"waiting for processes to terminate...")
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join)
+        log_listener.stop()
+    report_run(policy, metrics, output_dir, failed_file, metrics_file)
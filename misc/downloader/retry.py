@@ -0,0 +1,92 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from random import uniform
+from asyncio import TimeoutError
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from aiohttp import ClientConnectionError, ClientPayloadError, ClientResponseError
+from segmented import SegmentError
+from dedup import ChecksumError
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+RETRIES = 3
+RETRY_DELAY = 1.0  # seconds
+RETRY_MAX_DELAY = 60.0  # seconds
+RETRYABLE_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def retry_after(headers):
+    '''Return seconds to wait according to Retry-After header, None if absent
+    '''
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (date - datetime.now(timezone.utc)).total_seconds())
+
+def is_retryable(exc):
+    '''Determine if exc is a transient failure worth retrying
+    '''
+    if isinstance(exc, ClientResponseError):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, (ClientConnectionError, ClientPayloadError,
+                            TimeoutError, SegmentError, ChecksumError))
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class RetryPolicy:
+    '''Exponential backoff with full jitter and a cap on attempts per item
+
+    Items which exhausted their attempts or failed with a permanent error
+    are kept, in order, to produce a failure report.
+    '''
+    def __init__(self, retries=RETRIES, delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.attempts = {}
+        self.failed = {}
+
+    def schedule(self, item, exc):
+        '''Return the delay before item shall be retried, None if it shall not
+        '''
+        attempt = self.attempts.get(item, 0)
+        if attempt >= self.retries or not is_retryable(exc):
+            self.attempts.pop(item, None)
+            return None
+        self.attempts[item] = attempt + 1
+        delay = uniform(0, min(self.max_delay, self.delay * 2 ** attempt))
+        if isinstance(exc, ClientResponseError) and exc.headers:
+            delay = max(delay, retry_after(exc.headers) or 0)
+        return delay
+
+    def attempt(self, item):
+        '''Return the number of attempts already made for item
+        '''
+        return self.attempts.get(item, 0) + 1
+
+    def succeeded(self, item):
+        self.attempts.pop(item, None)
+
+    def give_up(self, url, exc, checksum=None):
+        '''Record url, and the checksum its content was expected to match, as
+        definitely failed
+        '''
+        self.failed.setdefault((url, checksum), exc)
+
+    def write_report(self, filepath):
+        '''Write failed urls to filepath so that it can be used as a url file,
+        checksums are kept in the second column
+        '''
+        with filepath.open('w') as fp:
+            for url, checksum in self.failed:
+                fp.write(f'{url} {checksum}\n' if checksum else f'{url}\n')
@@ -0,0 +1,131 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import os
+from threading import Lock
+from writer import preallocate
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+SEGMENT_THRESHOLD = 64 * 1024 * 1024  # 64M
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class SegmentError(Exception):
+    '''Raised when a segment cannot be fetched or the assembled file is invalid
+    '''
+
+class Segment:
+    '''Byte range [start, end] (inclusive) of a segmented download
+    '''
+    def __init__(self, download, index, start, end):
+        self.download = download
+        self.index = index
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return f"{self.download.url} [{self.index + 1}/{len(self.download.segments)}]"
+
+    @property
+    def length(self):
+        return self.end - self.start + 1
+
+class SegmentedDownload:
+    '''Download of a single file split into byte-range segments
+
+    Segments are written in place using positional writes into a file
+    preallocated to the final size, they can be completed in any order.
+    '''
+    def __init__(self, url, filepath, size, validator, count, done=(), checksum=None):
+        self.url = url
+        self.filepath = filepath
+        # (algorithm, hexdigest) the assembled file is expected to match
+        self.checksum = checksum
+        self.size = size
+        self.validator = validator
+        self.segments = []
+        for k in range(count):
+            start = size * k // count
+            end = size * (k + 1) // count - 1
+            self.segments.append(Segment(self, k, start, end))
+        self.done = set(done)
+        self.failed = False
+        self._fd = None
+        # writes run in executor threads, the file is closed once the
+        # writes in progress are over
+        self._lock = Lock()
+        self._writes = 0
+        self._closing = False
+
+    @property
+    def completed(self):
+        return len(self.done) == len(self.segments)
+
+    def pending(self):
+        '''Return segments which are not downloaded yet
+        '''
+        return [seg for seg in self.segments if seg.index not in self.done]
+
+    def open(self):
+        '''Open and preallocate the destination file
+        '''
+        self._fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size != self.size:
+            os.ftruncate(self._fd, self.size)
+        # reserve blocks so that out of order writes do not fragment the file
+        preallocate(self._fd, 0, self.size)
+
+    def close(self):
+        '''Close the destination file once writes in progress are over,
+        later writes are refused
+        '''
+        with self._lock:
+            self._closing = True
+            if not self._writes:
+                self._close()
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def write(self, offset, data):
+        '''Write data at given offset of the destination file
+        '''
+        with self._lock:
+            if self._closing:
+                raise SegmentError(f"download of {self.url} is closed")
+            self._writes += 1
+        try:
+            data = memoryview(data)
+            while data:
+                written = os.pwrite(self._fd, data, offset)
+                data = data[written:]
+                offset += written
+        finally:
+            with self._lock:
+                self._writes -= 1
+                if self._closing and not self._writes:
+                    self._close()
+
+    def complete(self, segment):
+        '''Mark segment as downloaded
+        '''
+        self.done.add(segment.index)
+
+    def fail(self):
+        '''Abort the download, pending segments will be dropped
+        '''
+        self.failed = True
+        self.close()
+
+    def verify(self):
+        '''Check that every segment was downloaded and file has expected size
+        '''
+        if not self.completed:
+            raise SegmentError(f"{len(self.pending())} segments missing for {self.url}")
+        size = os.fstat(self._fd).st_size
+        if size != self.size:
+            raise SegmentError(f"size mismatch for {self.url}: expected {self.size}, got {size}")
@@ -0,0 +1,148 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+from math import inf
+from time import monotonic
+from collections import deque
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+RATE = 0  # requests per second per host, 0 means unlimited
+BURST = 1
+LATENCY_TOLERANCE = 2.0  # latency above baseline * tolerance means congestion
+LATENCY_SLACK = 0.05  # seconds, ignore smaller latency variations
+DECREASE_FACTOR = 0.5
+THROTTLING_STATUSES = frozenset((429, 503))
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class TokenBucket:
+    '''Token bucket refilled at rate tokens per second up to burst tokens
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = monotonic()
+
+    def take(self, now):
+        '''Take a token, return 0 on success or the delay before one is available
+        '''
+        if not self.rate:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class HostLimiter:
+    '''Rate and concurrency limit applied to a single host
+
+    When adaptive, concurrency follows an AIMD law: it grows by one request
+    per window of successful requests and is halved on throttling responses,
+    errors or when time to first byte exceeds the observed baseline.
+    '''
+    def __init__(self, rate, burst, max_concurrency, adaptive):
+        self.bucket = TokenBucket(rate, burst)
+        self.adaptive = adaptive
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(2, max_concurrency) if adaptive else max_concurrency)
+        self.active = 0
+        self.pending = deque()
+        self.baseline = inf
+        self.blocked_until = 0
+        self.last_decrease = 0
+
+    def admit(self, now):
+        '''Return 0 if a request can start now, the delay before retrying
+        admission or inf if it must wait for an active request to end
+        '''
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.active + 1 > self.limit:
+            return inf
+        delay = self.bucket.take(now)
+        if not delay:
+            self.active += 1
+        return delay
+
+    def release(self):
+        '''End an active request, return pending items which may now start
+        '''
+        self.active -= 1
+        free = max(1, self.limit - self.active)
+        items = []
+        while self.pending and len(items) < free:
+            items.append(self.pending.popleft())
+        return items
+
+    def success(self, now, latency):
+        if not self.adaptive:
+            return
+        self.baseline = min(self.baseline, latency)
+        if (latency > self.baseline * LATENCY_TOLERANCE
+                and latency - self.baseline > LATENCY_SLACK):
+            self.decrease(now)
+            return
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def decrease(self, now, retry_after=None):
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if not self.adaptive:
+            return
+        # decrease at most once per baseline latency, concurrent failures
+        # are the consequence of the same congestion
+        if now - self.last_decrease < min(self.baseline, 1.0):
+            return
+        self.last_decrease = now
+        self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+
+class HostScheduler:
+    '''Per-host admission of queued items
+
+    Items of a host which cannot start are deferred instead of blocking the
+    worker so that a slow or throttling host does not starve the others.
+    '''
+    def __init__(self, rate=RATE, burst=BURST, max_concurrency=inf, adaptive=False):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self.hosts = {}
+
+    def limiter(self, host):
+        limiter = self.hosts.get(host)
+        if limiter is None:
+            limiter = HostLimiter(self.rate, self.burst,
+                                  self.max_concurrency, self.adaptive)
+            self.hosts[host] = limiter
+        return limiter
+
+    def admit(self, host, item):
+        '''Return 0 if item can start now, the delay after which it shall be
+        requeued, or None if it was deferred until a request of host ends
+        '''
+        limiter = self.limiter(host)
+        delay = limiter.admit(monotonic())
+        if delay == inf:
+            limiter.pending.append(item)
+            return None
+        return delay
+
+    def release(self, host):
+        '''End an active request of host, return deferred items to requeue
+        '''
+        return self.limiter(host).release()
+
+    def success(self, host, latency):
+        self.limiter(host).success(monotonic(), latency)
+
+    def failure(self, host, status=None, retry_after=None):
+        if status is not None and status < 500 and status not in THROTTLING_STATUSES:
+            # client errors such as 404 tell nothing about congestion
+            return
+        self.limiter(host).decrease(monotonic(), retry_after)
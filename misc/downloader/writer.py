@@ -0,0 +1,181 @@
+# -!- encoding:utf8 -!-
+# ------------------------------------------------------------------------------
+# IMPORTS
+# ------------------------------------------------------------------------------
+import os
+from mmap import mmap
+from fcntl import fcntl, F_GETFL, F_SETFL
+from asyncio import get_running_loop
+# ------------------------------------------------------------------------------
+# GLOBALS
+# ------------------------------------------------------------------------------
+WRITE_BUFFER = 256 * 1024  # 256k, initial size of write buffers
+MAX_WRITE_BUFFER = 8 * 1024 * 1024  # 8M
+DIRECT_ALIGNMENT = 4096
+O_DIRECT = getattr(os, 'O_DIRECT', 0)
+IOV_MAX = os.sysconf('SC_IOV_MAX')
+# ------------------------------------------------------------------------------
+# FUNCTIONS
+# ------------------------------------------------------------------------------
+def preallocate(fd, offset, length):
+    '''Reserve disk blocks for length bytes at offset, return False if the
+    platform or filesystem does not support it
+
+    Note that the file size grows to offset + length.
+    '''
+    if length <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except OSError:
+        return False
+    return True
+
+def write_all(fd, buffers):
+    '''Write buffers entirely to fd at its current position, gathering them
+    in as few syscalls as possible
+    '''
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        written = os.writev(fd, views[:IOV_MAX])
+        while views and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if written:
+            views[0] = views[0][written:]
+# ------------------------------------------------------------------------------
+# CLASSES
+# ------------------------------------------------------------------------------
+class FileWriter:
+    '''Write downloaded content to disk from the default executor
+
+    Chunks are gathered (without copy) in a buffer handed over to a thread once
+    full while the next buffer fills, at most one write per file is in flight
+    so that writes (and hashers updated along them) keep their order. Buffer size
+    starts at buffer_size and doubles after each write up to max_buffer: small
+    files do not hold large buffers, large ones are written with few syscalls.
+    A buffer size of 0 writes synchronously on the event loop.
+
+    When size is known, disk space is preallocated and the file is truncated
+    to what was actually written when closed.
+    '''
+    def __init__(self, filepath, offset=0, size=None, hashers=None,
+                 buffer_size=WRITE_BUFFER,
+                 max_buffer=MAX_WRITE_BUFFER,
+                 direct=False,
+                 fsync_every=0):
+        self.filepath = filepath
+        self.offset = offset
+        self.written = offset
+        self.size = size
+        self.hashers = hashers or {}
+        self.buffer_size = buffer_size
+        self.max_buffer = max(buffer_size, max_buffer)
+        self.direct = direct
+        self.fsync_every = fsync_every
+        self._fd = None
+        self._buffer = []
+        self._buffered = 0
+        self._pending = None
+        self._scratch = None
+        self._unsynced = 0
+        self._preallocated = False
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def open(self):
+        '''Open file, drop anything past offset and preallocate remaining size
+        '''
+        flags = os.O_WRONLY | os.O_CREAT
+        # direct I/O needs aligned offsets, sizes and memory
+        self.direct = bool(self.direct and O_DIRECT and self.buffer_size
+                           and not self.offset % DIRECT_ALIGNMENT)
+        if self.direct:
+            try:
+                self._fd = os.open(self.filepath, flags | O_DIRECT, 0o666)
+            except OSError:
+                # e.g. tmpfs does not support direct I/O
+                self.direct = False
+            else:
+                self.buffer_size = self.max_buffer = max(DIRECT_ALIGNMENT, self.max_buffer // DIRECT_ALIGNMENT * DIRECT_ALIGNMENT)
+                self._scratch = mmap(-1, self.max_buffer)
+        if self._fd is None:
+            self._fd = os.open(self.filepath, flags, 0o666)
+        os.ftruncate(self._fd, self.offset)
+        os.lseek(self._fd, self.offset, os.SEEK_SET)
+        if self.size is not None:
+            self._preallocated = preallocate(self._fd, self.offset, self.size - self.offset)
+
+    def _write(self, chunks, size):
+        '''Write chunks and update hashers, runs in the executor (or inline)
+        '''
+        if self.direct:
+            # chunks are copied to aligned memory
+            self._scratch[:size] = b''.join(chunks)
+            write_all(self._fd, [memoryview(self._scratch)[:size]])
+        else:
+            write_all(self._fd, chunks)
+        for hasher in self.hashers.values():
+            for chunk in chunks:
+                hasher.update(chunk)
+        self._unsynced += size
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            os.fsync(self._fd)
+            self._unsynced = 0
+        return size
+
+    async def _wait(self):
+        if self._pending:
+            pending, self._pending = self._pending, None
+            self.written += await pending
+
+    async def _flush(self):
+        await self._wait()
+        chunks, size = self._buffer, self._buffered
+        if self.direct:
+            # unaligned tail waits for more data or the end of the file
+            data = b''.join(chunks)
+            size = min(size, self.max_buffer) // DIRECT_ALIGNMENT * DIRECT_ALIGNMENT
+            chunks, self._buffer = [data[:size]], [data[size:]]
+            self._buffered -= size
+        else:
+            self._buffer, self._buffered = [], 0
+            self.buffer_size = min(self.buffer_size * 2, self.max_buffer)
+        if size:
+            self._pending = get_running_loop().run_in_executor(None, self._write, chunks, size)
+
+    async def write(self, chunk):
+        if not self.buffer_size:
+            self.written += self._write([chunk], len(chunk))
+            return
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        if self._buffered >= self.buffer_size:
+            await self._flush()
+
+    async def close(self):
+        '''Write buffered data and close the file
+
+        Buffered data is written even if the download failed so that it can
+        be resumed from there.
+        '''
+        try:
+            await self._flush()
+            if self.direct and self._buffered:
+                await self._wait()
+                fcntl(self._fd, F_SETFL, fcntl(self._fd, F_GETFL) & ~O_DIRECT)
+                self.direct = False
+                await self._flush()
+            await self._wait()
+            if self._preallocated:
+                os.ftruncate(self._fd, self.written)
+            if self.fsync_every:
+                os.fsync(self._fd)
+        finally:
+            os.close(self._fd)
+            if self._scratch:
+                self._scratch.close()
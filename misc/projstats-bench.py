@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -!- encoding:utf8 -!-
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    file: projstats-bench.py
+# purpose:
+#       Benchmarks of projstats on synthetic trees
+# license:
+#       GPLv3
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#   IMPORTS
+#-------------------------------------------------------------------------------
+import os
+import random
+import fnmatch
+import argparse
+import time
+import tracemalloc
+from time import perf_counter
+from tempfile import TemporaryDirectory
+import projstats
+#-------------------------------------------------------------------------------
+#   GLOBALS
+#-------------------------------------------------------------------------------
+SCENARIOS = {}
+LINE = (b'    value = compute(value, index) // some source code\n'
+        b'    /* a comment */\n'
+        b'    print("%d\\n", value);\n'
+        b'\n')
+#-------------------------------------------------------------------------------
+#   FUNCTIONS
+#-------------------------------------------------------------------------------
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+def make_tree(root, dirs, files, file_size, seed=0):
+    # dirs directories of files text files, about file_size bytes each
+    rnd = random.Random(seed)
+    for d in range(dirs):
+        dirpath = os.path.join(root, 'd%d' % (d % 10), 's%d' % d)
+        os.makedirs(dirpath, exist_ok=True)
+        for f in range(files):
+            ext = rnd.choice(('c', 'h', 'py', 'sh', 'txt'))
+            lines = max(1, rnd.randint(file_size // 2, file_size * 3 // 2) // len(LINE))
+            with open(os.path.join(dirpath, 'f%d.%s' % (f, ext)), 'wb') as fp:
+                fp.write(LINE * lines)
+
+def make_file(fpath, size):
+    with open(fpath, 'wb') as fp:
+        block = LINE * (1024 * 1024 // len(LINE))
+        for _ in range(size // len(block)):
+            fp.write(block)
+
+def age_tree(root, seconds=3600):
+    # files modified in the last seconds are not cached
+    mtime = time.time() - seconds
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            os.utime(os.path.join(dirpath, f), (mtime, mtime))
+
+def tree_bytes(root):
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+def read_split(fpath):
+    # line counting of projstats before chunked counting
+    with open(fpath, 'r') as f:
+        return len(f.read().split('\n'))
+
+def measure(func, *args):
+    # return (seconds, peak traced memory in bytes), memory is measured by a
+    # separate run as tracing slows allocations down
+    start = perf_counter()
+    func(*args)
+    elapsed = perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def report(label, elapsed, size, peak=None):
+    line = '    %-28s %8.3fs %10.1f MiB/s' % (label, elapsed, size / elapsed / 2**20)
+    if peak is not None:
+        line += ' %10.1f MiB peak' % (peak / 2**20)
+    print(line)
+
+def scan(root, no_comment=False, **options):
+    stats = projstats.Statistics(False, '', '', '', '', no_comment, **options)
+    stats.scan(root)
+    return stats
+
+@scenario
+def line_counting(scale):
+    """line counting throughput and memory on small and large files"""
+    with TemporaryDirectory() as root:
+        make_tree(root, 10 * scale, 100, 4096)
+        size = tree_bytes(root)
+        fpaths = [os.path.join(dirpath, f)
+                  for dirpath, _, files in os.walk(root) for f in files]
+        print('  %d small files, %.1f MiB' % (len(fpaths), size / 2**20))
+        for label, counter in (('read and split', read_split),
+                               ('chunked', projstats.count_lines)):
+            elapsed, peak = measure(lambda: [counter(f) for f in fpaths])
+            report(label, elapsed, size, peak)
+        big = os.path.join(root, 'big.log')
+        make_file(big, 64 * scale * 2**20)
+        size = os.path.getsize(big)
+        print('  1 large file, %.1f MiB' % (size / 2**20))
+        for label, counter in (('read and split', read_split),
+                               ('chunked', projstats.count_lines)):
+            elapsed, peak = measure(counter, big)
+            report(label, elapsed, size, peak)
+
+@scenario
+def classification(scale):
+    """line counting against code/comment/blank classification"""
+    with TemporaryDirectory() as root:
+        make_tree(root, 10 * scale, 100, 16384)
+        size = tree_bytes(root)
+        print('  %d files, %.1f MiB' % (1000 * scale, size / 2**20))
+        for label, no_comment in (('line counting', False),
+                                  ('classification', True)):
+            start = perf_counter()
+            scan(root, no_comment=no_comment)
+            report(label, perf_counter() - start, size)
+
+@scenario
+def parallel_scan(scale):
+    """sequential and parallel scans of a tree"""
+    with TemporaryDirectory() as root:
+        make_tree(root, 20 * scale, 100, 8192)
+        size = tree_bytes(root)
+        print('  %d files, %.1f MiB' % (2000 * scale, size / 2**20))
+        for jobs in (1, 2, 4):
+            start = perf_counter()
+            scan(root, jobs=jobs)
+            report('%d job(s)' % jobs, perf_counter() - start, size)
+
+@scenario
+def incremental(scale):
+    """scans without cache, with a cold cache and after changing 1% of files"""
+    with TemporaryDirectory() as root:
+        make_tree(os.path.join(root, 'tree'), 50 * scale, 100, 8192)
+        tree = os.path.join(root, 'tree')
+        age_tree(tree)
+        size = tree_bytes(tree)
+        cache = os.path.join(root, 'cache.json')
+        print('  %d files, %.1f MiB' % (5000 * scale, size / 2**20))
+        start = perf_counter()
+        scan(tree)
+        report('no cache', perf_counter() - start, size)
+        start = perf_counter()
+        scan(tree, cache=cache)
+        report('cold cache', perf_counter() - start, size)
+        start = perf_counter()
+        scan(tree, cache=cache)
+        report('warm cache', perf_counter() - start, size)
+        mtime = time.time() - 3600
+        fpaths = sorted(os.path.join(dirpath, f)
+                        for dirpath, _, files in os.walk(tree) for f in files)
+        for fpath in fpaths[::100]:
+            with open(fpath, 'ab') as fp:
+                fp.write(LINE)
+            os.utime(fpath, (mtime, mtime))
+        start = perf_counter()
+        stats = scan(tree, cache=cache)
+        report('%d files changed' % (5000 * scale - stats.cache.hits),
+            perf_counter() - start, size)
+
+def fnmatch_any(patterns, name):
+    # filtering of projstats before compiled patterns
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+@scenario
+def matching(scale):
+    """per-pattern fnmatch against compiled patterns on file names"""
+    rnd = random.Random(0)
+    exts = ['c', 'h', 'py', 'js', 'ts', 'md', 'txt', 'json', 'yml', 'o']
+    globs = ['*.%s' % ext for ext in exts[:6]] + ['test_*', '*_test.*', '.*',
+             'Makefile', '*.min.*', '*~'] + ['gen%d_*' % k for k in range(30)]
+    names = ['%s%d.%s' % (rnd.choice(('f', 'test_', 'gen', 'mod')),
+                          rnd.randrange(1000), rnd.choice(exts))
+             for _ in range(100000 * scale)]
+    print('  %d names, %d patterns' % (len(names), len(globs)))
+    patterns = projstats.Patterns(','.join(globs))
+    for label, match in (('fnmatch per pattern', lambda n: fnmatch_any(globs, n)),
+                         ('compiled', lambda n: patterns.match(n, ''))):
+        start = perf_counter()
+        matched = sum(1 for name in names if match(name))
+        elapsed = perf_counter() - start
+        print('    %-28s %8.3fs %10.0f names/s %8d matched' % (label, elapsed,
+              len(names) / elapsed, matched))
+
+def synthetic_files(files):
+    # (directory, name, size, lines) of files of a synthetic tree, 100 per
+    # directory, names repeat across directories as in real trees
+    for k in range(files):
+        d = k // 100
+        size = k * 7919 % 65536
+        yield ('root/p%d/d%d' % (d % 100, d), 'f%d.%s' % (k % 100,
+            ('c', 'h', 'py', 'js', 'txt')[k % 5]), size, size // 40)
+
+def dict_per_file(files):
+    # statistics held by a dict per file, keyed by path
+    table = {}
+    for dirpath, fname, size, lines in synthetic_files(files):
+        table[dirpath + '/' + fname] = {'size': size, 'lines': lines}
+    return table
+
+def file_table(files):
+    table = projstats.FileTable()
+    dirs = {}
+    for dirpath, fname, size, lines in synthetic_files(files):
+        directory = dirs.get(dirpath)
+        if directory is None:
+            directory = dirs[dirpath] = table.add_dir(-1, dirpath)
+        table.add_file(directory, fname, size, lines)
+    return table
+
+@scenario
+def memory(scale):
+    """memory of per-file statistics of a synthetic tree (not on disk)"""
+    files = 5000000 * scale
+    print('  %d files' % files)
+    for label, build in (('dict per file', dict_per_file),
+                         ('file table', file_table)):
+        # not timed, tracing slows allocations down
+        tracemalloc.start()
+        table = build(files)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('    %-28s %10.1f MiB %8.1f bytes/file' % (label, size / 2**20,
+              size / files))
+        del table
+    table = file_table(files)
+    start = perf_counter()
+    table.largest_files(10)
+    table.largest_dirs(10)
+    print('    %-28s %8.3fs' % ('top 10 files and dirs', perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark projstats on synthetic trees.')
+    parser.add_argument('--scale', type=int, default=1,
+        help='multiply the size of synthetic trees')
+    parser.add_argument('scenarios', nargs='*',
+        help='scenarios to run among %s, all by default' % ', '.join(SCENARIOS))
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario: %s' % name)
+    for name in args.scenarios or SCENARIOS:
+        print('%s: %s' % (name, SCENARIOS[name].__doc__))
+        SCENARIOS[name](args.scale)
+#-------------------------------------------------------------------------------
+#   SCRIPT
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
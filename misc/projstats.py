@@ -12,107 +12,1223 @@
 #   IMPORTS
 #-------------------------------------------------------------------------------
 import os
+import re
+import csv
+import sys
+import json
+import time
+import heapq
+import ctypes
+import ctypes.util
+import select
+import struct
 import fnmatch
 import argparse
+import subprocess
+from array import array
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, wait,
+    FIRST_COMPLETED)
+#-------------------------------------------------------------------------------
+#   GLOBALS
+#-------------------------------------------------------------------------------
+BATCH_SIZE = 64 # files counted by a worker process at once
+CHUNK_SIZE = 1024 * 1024 # 1M
+BINARY_PROBE = 8000 # like git, files with a NUL byte in there are binary
+CACHE_VERSION = 2
+REPORT_VERSION = 1
+TOP = 10 # largest files and directories in reports
+# inotify(7) events of watched directories
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+INOTIFY_EVENT = struct.Struct('iIII') # wd, mask, cookie, name length
+LANGUAGE_COLUMNS = ('files', 'code', 'comment', 'blank')
+# language: (extensions or file names, line comments, block comments, strings,
+#            multi-line strings)
+LANGUAGES = {
+    'C': (('c', 'h'), ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'C++': (('cpp', 'cc', 'cxx', 'hpp', 'hh', 'hxx', 'ino'),
+        ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'C#': (('cs',), ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'Java': (('java',), ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'Kotlin': (('kt', 'kts'), ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'Scala': (('scala',), ('//',), (('/*', '*/'),), ('"', "'"), ()),
+    'Swift': (('swift',), ('//',), (('/*', '*/'),), ('"',), ()),
+    'Go': (('go',), ('//',), (('/*', '*/'),), ('"', "'"), ('`',)),
+    'Rust': (('rs',), ('//',), (('/*', '*/'),), ('"',), ()),
+    'JavaScript': (('js', 'mjs', 'cjs', 'jsx'),
+        ('//',), (('/*', '*/'),), ('"', "'"), ('`',)),
+    'TypeScript': (('ts', 'tsx'), ('//',), (('/*', '*/'),), ('"', "'"), ('`',)),
+    'PHP': (('php',), ('//', '#'), (('/*', '*/'),), ('"', "'"), ()),
+    'CSS': (('css', 'scss', 'less'), (), (('/*', '*/'),), ('"', "'"), ()),
+    'Assembly': (('s', 'S', 'asm', 'inc'),
+        (';', '#', '//'), (('/*', '*/'),), ('"',), ()),
+    'Python': (('py', 'pyw', 'pyi'), ('#',), (), ('"', "'"), ('"""', "'''")),
+    'Shell': (('sh', 'bash', 'zsh', 'ksh'), ('#',), (), (), ('"', "'")),
+    'Perl': (('pl', 'pm'), ('#',), (), (), ('"', "'")),
+    'Ruby': (('rb',), ('#',), (), (), ('"', "'")),
+    'Makefile': (('mk', 'Makefile', 'GNUmakefile', 'makefile'), ('#',), (), (), ()),
+    'CMake': (('cmake', 'CMakeLists.txt'), ('#',), (), ('"',), ()),
+    'Dockerfile': (('Dockerfile',), ('#',), (), (), ()),
+    'YAML': (('yml', 'yaml'), ('#',), (), ('"', "'"), ()),
+    'TOML': (('toml',), ('#',), (), ('"', "'"), ()),
+    'SQL': (('sql',), ('--',), (('/*', '*/'),), ("'",), ()),
+    'Lua': (('lua',), ('--',), (('--[[', ']]'),), ('"', "'"), ()),
+    'Haskell': (('hs',), ('--',), (('{-', '-}'),), ('"',), ()),
+    'HTML': (('html', 'htm', 'xml', 'xsd', 'svg', 'vue'),
+        (), (('<!--', '-->'),), (), ()),
+    'TeX': (('tex', 'sty', 'cls'), ('%',), (), (), ()),
+}
+LANGUAGE_OF = {ext: language
+    for language, (exts, _, _, _, _) in LANGUAGES.items() for ext in exts}
+OTHER = 'other'
+# tokens of the line classifier
+NEWLINE, ESCAPE, SWITCH, DOCSTRING = range(4)
+NONSPACE = re.compile(rb'\S')
+SPACE = rb'[ \t\r\f\v]'
+RACY_DELAY = 2 # seconds, files modified since then may change unnoticed
+#-------------------------------------------------------------------------------
+#   FUNCTIONS
+#-------------------------------------------------------------------------------
+def stat_key(fpath):
+    st = os.stat(fpath)
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def list_dir(dirpath, with_keys=False):
+    # same split as os.walk: symlinks to directories are listed as directories
+    # but not followed, errors are ignored; files are (name, stat key) tuples,
+    # keys are None unless requested
+    dirs, files = [], []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs.append((entry.name, entry.is_symlink()))
+                else:
+                    key = None
+                    if with_keys:
+                        try:
+                            st = entry.stat()
+                            key = [st.st_mtime_ns, st.st_size, st.st_ino]
+                        except OSError:
+                            pass
+                    files.append((entry.name, key))
+    except OSError:
+        pass
+    return dirs, files
+
+def git_files(root):
+    # files of the git work tree below root as (path, key) tuples: unmodified
+    # tracked files are keyed by their blob id so they do not even need to be
+    # stat'ed, keys of other files are None
+    def git(*args):
+        output = subprocess.run(('git', '-C', root) + args, check=True,
+            stdout=subprocess.PIPE).stdout
+        return [os.fsdecode(path) for path in output.split(b'\0') if path]
+    staged = git('ls-files', '--stage', '-z')
+    modified = set(git('diff', '--name-only', '--relative', '-z'))
+    deleted = set(git('ls-files', '--deleted', '-z'))
+    blobs = {}
+    for line in staged:
+        info, path = line.split('\t', 1)
+        mode, blob, stage = info.split()
+        # submodules and symlinks are not files of the work tree
+        if mode in ('160000', '120000') or path in deleted:
+            continue
+        # conflicting paths are listed once per stage
+        if stage != '0' or path in modified:
+            blob = None
+        blobs[path] = blob if path not in blobs else None
+    for path in git('ls-files', '--others', '--exclude-standard', '-z'):
+        blobs[path] = None
+    return sorted(blobs.items())
+
+def count_lines(fpath):
+    # memory is bounded by the chunk size, content is never decoded, return
+    # None for binary files
+    lines = 0
+    with open(fpath, 'rb', buffering=0) as f:
+        chunk = f.read(CHUNK_SIZE)
+        if chunk.find(b'\0', 0, BINARY_PROBE) >= 0:
+            return None
+        last = b'\n'
+        while chunk:
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+            chunk = f.read(CHUNK_SIZE)
+    # last line may not be terminated
+    if last != b'\n':
+        lines += 1
+    return lines
+
+def language_of(fname):
+    language = LANGUAGE_OF.get(fname)
+    if language is None and '.' in fname:
+        language = LANGUAGE_OF.get(fname.split('.')[-1])
+    return language or OTHER
+
+def classify_lines(fpath):
+    # single pass over chunks of bytes: a regex finds the next token of the
+    # current mode (newline, comment or string delimiter, escape) and the
+    # text in between is only checked for non-space characters; return
+    # (code, comment, blank) line counts or None for binary files
+    syntax = Syntax.of(language_of(os.path.basename(fpath)))
+    code = mode = syntax.code
+    nonspace = NONSPACE.search
+    last = b''
+    counts = [0, 0, 0]
+    marks = [False, False] # current line has code, comment
+    with open(fpath, 'rb', buffering=0) as f:
+        buf = f.read(CHUNK_SIZE)
+        if buf.find(b'\0', 0, BINARY_PROBE) >= 0:
+            return None
+        while buf:
+            chunk = f.read(CHUNK_SIZE)
+            # a token starting before limit is entirely in the buffer, the
+            # tail is processed with the next chunk
+            limit = len(buf) - syntax.max_token + 1 if chunk else len(buf)
+            pos = 0
+            while True:
+                if mode is code and not (marks[0] or marks[1]):
+                    # fast path: complete lines up to the next hazard
+                    stop = syntax.safe_lines(buf, pos, limit)
+                    if stop > pos:
+                        lines = buf.count(b'\n', pos, stop)
+                        blank = len(syntax.blank_lines.findall(buf, pos, stop))
+                        comment = 0
+                        if syntax.comment_lines is not None:
+                            comment = len(syntax.comment_lines.findall(buf,
+                                pos, stop))
+                        counts[0] += lines - blank - comment
+                        counts[1] += comment
+                        counts[2] += blank
+                        pos = stop
+                        continue
+                m = mode.regex.search(buf, pos)
+                if m is None:
+                    start = end = limit
+                else:
+                    start, end = m.span()
+                    if start >= limit:
+                        start = limit
+                if pos < start and not marks[mode.is_comment] \
+                        and nonspace(buf, pos, start):
+                    marks[mode.is_comment] = True
+                if start == limit:
+                    pos = max(pos, limit)
+                    break
+                pos = end
+                kind, target = mode.actions[m.lastindex]
+                if kind == NEWLINE or (kind == ESCAPE and buf[pos-1] == 10):
+                    # code, comment or blank line
+                    counts[0 if marks[0] else 1 if marks[1] else 2] += 1
+                    marks[0] = marks[1] = False
+                    if kind == NEWLINE:
+                        mode = mode.newline_mode or mode
+                    continue
+                if kind == DOCSTRING and not marks[0]:
+                    # string starting a line, e.g. a python docstring
+                    target = target.docstring
+                marks[mode.is_comment or target.is_comment] = True
+                mode = target
+            last = buf[-1:]
+            buf = buf[pos:] + chunk
+    # last line may not be terminated
+    if last not in (b'', b'\n'):
+        counts[0 if marks[0] else 1 if marks[1] else 2] += 1
+    return tuple(counts)
+
+def count_file(counter, fpath):
+    # (size, lines) of a file
+    return os.path.getsize(fpath), counter(fpath)
+
+def count_batch(counter, fpaths):
+    return [count_file(counter, fpath) for fpath in fpaths]
+
+def translate_path(pattern):
+    # like fnmatch.translate for paths: '*', '?' and brackets do not match
+    # '/', '**' matches any number of directories
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            res.append('.*')
+            i += 2
+        elif c == '*':
+            res.append('[^/]*')
+            i += 1
+        elif c == '?':
+            res.append('[^/]')
+            i += 1
+        elif c == '[' and pattern.find(']', i + 2) > 0:
+            j = pattern.find(']', i + 2)
+            body = pattern[i+1:j].replace('\\', '\\\\').replace('[', '\\[')
+            if body.startswith('!'):
+                body = '^/' + body[1:]
+            elif body.startswith('^'):
+                body = '\\' + body
+            res.append('[%s]' % body)
+            i = j + 1
+        else:
+            res.append(re.escape(c))
+            i += 1
+    return '(?s:%s)\\Z' % ''.join(res)
 #-------------------------------------------------------------------------------
 #   CLASSES
 #-------------------------------------------------------------------------------
+class Patterns(object):
+    # comma-separated globs compiled once into a single regex: globs without
+    # '/' match names, others match paths relative to the scanned directory
+    __slots__ = ('globs', 'names', 'paths')
+
+    def __init__(self, globs):
+        super(Patterns, self).__init__()
+        self.globs = set(filter(None, globs.split(',')))
+        # 'build/' is a directory name, '/build' is anchored
+        globs = set(glob.rstrip('/') or glob for glob in self.globs)
+        # fnmatch is case insensitive where paths are
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        names = [fnmatch.translate(glob) for glob in globs if '/' not in glob]
+        paths = [translate_path(glob.lstrip('/')) for glob in globs if '/' in glob]
+        self.names = re.compile('|'.join(names), flags).match if names else None
+        self.paths = re.compile('|'.join(paths), flags).match if paths else None
+
+    def __len__(self):
+        return len(self.globs)
+
+    def match(self, name, parent):
+        # parent is the relative path of the directory containing name
+        if self.names is not None and self.names(name):
+            return True
+        if self.paths is not None:
+            return self.paths(parent + '/' + name if parent else name) is not None
+        return False
+
+class FileTable(object):
+    # statistics of files stored by columns: a file costs a few array items
+    # instead of Python objects, and names are interned so that names shared
+    # by many files or directories (e.g. __init__.py, src) are stored once
+    __slots__ = ('names', 'name_ids', 'dir_ids', 'dir_parent', 'dir_name',
+        'dir_files', 'dir_lines', 'dir_size', 'file_dir', 'file_name',
+        'file_size', 'file_lines', 'histogram')
+
+    def __init__(self):
+        super(FileTable, self).__init__()
+        self.names = []
+        self.name_ids = {}
+        # (parent, name id): directory, roots have no parent (-1) and are
+        # named after their path
+        self.dir_ids = {}
+        self.dir_parent = array('q')
+        self.dir_name = array('I')
+        # counts of directories include their subdirectories
+        self.dir_files = array('q')
+        self.dir_lines = array('q')
+        self.dir_size = array('q')
+        self.file_dir = array('I')
+        self.file_name = array('I')
+        self.file_size = array('q')
+        self.file_lines = array('q')
+        # files by size.bit_length(), i.e. sizes in [2**(k-1), 2**k)
+        self.histogram = [0] * 65
+
+    def __len__(self):
+        return len(self.file_dir)
+
+    def intern(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def add_dir(self, parent, name):
+        key = (parent, self.intern(name))
+        directory = self.dir_ids.get(key)
+        if directory is None:
+            directory = self.dir_ids[key] = len(self.dir_parent)
+            self.dir_parent.append(parent)
+            self.dir_name.append(key[1])
+            self.dir_files.append(0)
+            self.dir_lines.append(0)
+            self.dir_size.append(0)
+        return directory
+
+    def add_file(self, directory, name, size, lines, count=True):
+        # files which are not counted are only listed, they do not add to
+        # directories and to the histogram
+        self.file_dir.append(directory)
+        self.file_name.append(self.intern(name))
+        self.file_size.append(size)
+        self.file_lines.append(lines)
+        if not count:
+            return
+        self.histogram[size.bit_length()] += 1
+        while directory >= 0:
+            self.dir_files[directory] += 1
+            self.dir_lines[directory] += lines
+            self.dir_size[directory] += size
+            directory = self.dir_parent[directory]
+
+    def remove_file(self, index):
+        # the row of a removed file is kept with a negative size
+        size, lines = self.file_size[index], self.file_lines[index]
+        self.histogram[size.bit_length()] -= 1
+        directory = self.file_dir[index]
+        while directory >= 0:
+            self.dir_files[directory] -= 1
+            self.dir_lines[directory] -= lines
+            self.dir_size[directory] -= size
+            directory = self.dir_parent[directory]
+        self.file_size[index] = -1
+        self.file_lines[index] = 0
+
+    def dir_path(self, directory):
+        names = []
+        while directory >= 0:
+            names.append(self.names[self.dir_name[directory]])
+            directory = self.dir_parent[directory]
+        return os.path.join(*reversed(names))
+
+    def file_path(self, index):
+        return os.path.join(self.dir_path(self.file_dir[index]),
+            self.names[self.file_name[index]])
+
+    def __largest(self, column, n, path):
+        # indexes of the n largest values of column, ties are broken by path
+        # so that results do not depend on scanning order
+        indexes = [i for i in heapq.nlargest(n, range(len(column)),
+            key=column.__getitem__) if column[i] >= 0]
+        if not indexes:
+            return indexes
+        last = column[indexes[-1]]
+        indexes = sorted((i for i in indexes if column[i] > last),
+            key=lambda i: (-column[i], path(i)))
+        ties = (i for i in range(len(column)) if column[i] == last)
+        return indexes + heapq.nsmallest(n - len(indexes), ties, key=path)
+
+    def largest_files(self, n):
+        # indexes of the n largest files
+        return self.__largest(self.file_size, n, self.file_path)
+
+    def largest_dirs(self, n):
+        return self.__largest(self.dir_size, n, self.dir_path)
+
+class Inotify(object):
+    # events of watched directories through inotify(7), Linux only
+    def __init__(self):
+        super(Inotify, self).__init__()
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__add_watch = libc.inotify_add_watch
+        self.__add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor: directory
+        self.watches = {}
+
+    def add(self, dirpath):
+        wd = self.__add_watch(self.fd, os.fsencode(dirpath), INOTIFY_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), dirpath)
+        self.watches[wd] = dirpath
+
+    def read(self, timeout=None):
+        # return (path, mask) of events, waiting for timeout seconds at most;
+        # path is None when events were lost
+        events = []
+        if not select.select((self.fd,), (), (), timeout)[0]:
+            return events
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = os.fsdecode(data[pos:pos+length].rstrip(b'\0'))
+                pos += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, mask))
+                elif mask & IN_IGNORED:
+                    # directory removed
+                    self.watches.pop(wd, None)
+                elif wd in self.watches and name:
+                    events.append((os.path.join(self.watches[wd], name), mask))
+
+    def close(self):
+        os.close(self.fd)
+
+class Mode(object):
+    # state of the line classifier: tokens it looks for and what they do
+    __slots__ = ('is_comment', 'regex', 'actions', 'newline_mode', 'docstring')
+
+    def __init__(self, is_comment, newline_mode=None):
+        super(Mode, self).__init__()
+        self.is_comment = is_comment
+        # mode after a newline, stays the same if None
+        self.newline_mode = newline_mode
+        self.regex = None
+        self.actions = None
+        self.docstring = None
+
+    def compile(self, tokens):
+        # tokens are (bytes, kind, target mode), longest tokens first so that
+        # e.g. '--[[' wins over '--'
+        tokens = [(b'\n', NEWLINE, None)] + sorted(tokens,
+            key=lambda token: -len(token[0]))
+        patterns = []
+        for token, kind, _ in tokens:
+            pattern = re.escape(token)
+            if kind == ESCAPE:
+                # escaped character, newline included
+                pattern += rb'[\s\S]'
+            patterns.append(b'(' + pattern + b')')
+        self.regex = re.compile(b'|'.join(patterns))
+        self.actions = [None] + [(kind, target or self)
+            for _, kind, target in tokens]
+
+class Syntax(object):
+    # classifier modes of a language
+    __slots__ = ('code', 'safe', 'blank_lines', 'comment_lines',
+        'max_token')
+    SYNTAXES = {}
+
+    def __init__(self, line_comments, block_comments, strings,
+        multiline_strings, docstrings):
+        super(Syntax, self).__init__()
+        self.code = Mode(False)
+        tokens = []
+        for token in line_comments:
+            comment = Mode(True, self.code)
+            comment.compile([])
+            tokens.append((token.encode(), SWITCH, comment))
+        for start, end in block_comments:
+            comment = Mode(True)
+            comment.compile([(end.encode(), SWITCH, self.code)])
+            tokens.append((start.encode(), SWITCH, comment))
+        for delim in strings + multiline_strings:
+            # single line strings end at the end of line, unterminated or not
+            string = Mode(False, None if delim in multiline_strings else self.code)
+            string.compile([(b'\\', ESCAPE, None),
+                (delim.encode(), SWITCH, self.code)])
+            kind = SWITCH
+            if docstrings and delim in multiline_strings:
+                kind = DOCSTRING
+                string.docstring = Mode(True)
+                string.docstring.compile([(b'\\', ESCAPE, None),
+                    (delim.encode(), SWITCH, self.code)])
+            tokens.append((delim.encode(), kind, string))
+        self.code.compile(tokens)
+        # lines can be classified independently, by regexes running over
+        # whole regions of the buffer, until a line may end in a comment or
+        # a string: these lines are hazards
+        def pair(start, end, escapes):
+            # start, anything but end on the same line, end; loop unrolled
+            # around the first character of end
+            first = re.escape(end[:1])
+            others = b'[^%s%s\\n]*' % (first, b'\\\\' if escapes else b'')
+            inner = b'(?!%s)%s' % (re.escape(end), first) if len(end) > 1 \
+                else b'(?!)'
+            if escapes:
+                inner += rb'|\\[^\n]'
+            return b'%s%s(?:(?:%s)%s)*%s' % (re.escape(start), others, inner,
+                others, re.escape(end))
+        block_comments = [(start.encode(), end.encode())
+            for start, end in block_comments]
+        strings = [delim.encode() for delim in strings]
+        multiline_strings = [delim.encode() for delim in multiline_strings]
+        # (token, is hazard, pattern): closed pairs are skipped, unclosed
+        # block comments and multi-line strings and escaped newlines are
+        # hazards
+        alternatives = [(start, False, pair(start, end, False))
+            for start, end in block_comments]
+        alternatives += [(delim, False, pair(delim, delim, True))
+            for delim in strings + multiline_strings]
+        alternatives += [(start, True, re.escape(start))
+            for start, _ in block_comments]
+        alternatives += [(delim, True, re.escape(delim))
+            for delim in multiline_strings]
+        if strings or multiline_strings:
+            # e.g. string continued on the next line
+            alternatives.append((b'\\\n', True, rb'\\\n'))
+        self.safe = None
+        if any(is_hazard for _, is_hazard, _ in alternatives):
+            # matches up to the first hazard, as tokens would be found: the
+            # longest tokens win, e.g. '"""' over '"', then pairs
+            alternatives.sort(key=lambda alt: (-len(alt[0]), alt[1]))
+            specials = re.escape(bytes(sorted(set(token[0]
+                for token, _, _ in alternatives))))
+            safe = b'[%s]' % specials
+            for _, is_hazard, pattern in reversed(alternatives):
+                if is_hazard:
+                    safe = b'(?!%s)(?:%s)' % (pattern, safe)
+                else:
+                    safe = b'%s|%s' % (pattern, safe)
+            self.safe = re.compile(b'(?:[^%s]+|%s)*' % (specials, safe))
+        self.blank_lines = re.compile(b'^%s*\n' % SPACE, re.M)
+        # lines with comments only: comment pairs, e.g. python docstrings,
+        # and a line comment ('--' is not a line comment if it starts '--[[')
+        comments = [pair(start, end, False) for start, end in block_comments]
+        if docstrings:
+            comments += [pair(delim, delim, True) for delim in multiline_strings]
+        line_comments = [comment.encode() for comment in line_comments]
+        line_comments = [re.escape(comment) + b''.join(b'(?!%s)'
+            % re.escape(token[len(comment):]) for token, _, _ in tokens
+            if token != comment and token.startswith(comment))
+            for comment in line_comments]
+        patterns = []
+        trailing = b''
+        if line_comments:
+            trailing = b'(?:%s)[^\n]*' % b'|'.join(line_comments)
+            patterns.append(trailing)
+        if comments:
+            patterns.append(b'(?:(?:%s)%s*)+(?:%s)?' % (b'|'.join(comments),
+                SPACE, trailing))
+        self.comment_lines = re.compile(b'^%s*(?:%s)\n' % (SPACE,
+            b'|'.join(patterns)), re.M) if patterns else None
+        self.max_token = max([2] + [len(token) for token, _, _ in tokens]
+            + [len(end) for _, end in block_comments])
+
+    def safe_lines(self, buf, pos, limit):
+        # return the end of complete lines starting at pos which are free of
+        # hazard
+        stop = buf.rfind(b'\n', pos, limit) + 1
+        if stop <= pos or self.safe is None:
+            return max(pos, stop)
+        hazard = self.safe.match(buf, pos, stop).end()
+        if hazard == stop:
+            return stop
+        return max(pos, buf.rfind(b'\n', pos, hazard) + 1)
+
+    @classmethod
+    def of(cls, language):
+        syntax = cls.SYNTAXES.get(language)
+        if syntax is None:
+            _, line_comments, block_comments, strings, multiline_strings = \
+                LANGUAGES.get(language, ((), (), (), (), ()))
+            syntax = cls(line_comments, block_comments, strings,
+                multiline_strings, language == 'Python')
+            cls.SYNTAXES[language] = syntax
+        return syntax
+
+class StatCache(object):
+    def __init__(self, fpath, counter):
+        super(StatCache, self).__init__()
+        self.fpath = fpath
+        # cached counts are those of counter
+        self.counter = counter
+        self.entries = {}
+        # entries of files seen by the current scan, others are not saved
+        self.seen = {}
+        self.hits = 0
+        self.dirty = False
+        self.started = None
+
+    def load(self):
+        self.started = time.time_ns()
+        try:
+            with open(self.fpath, 'r') as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return
+        if (content.get('version') == CACHE_VERSION
+                and content.get('counter') == self.counter):
+            self.entries = content['files']
+
+    def get(self, fpath, key):
+        # return cached [key, lines, size] entry of fpath or None
+        entry = self.entries.get(fpath)
+        if entry is None or entry[0] != key:
+            return None
+        self.seen[fpath] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, fpath, key, lines, size):
+        # a file written in the same timestamp granularity as the scan could
+        # change again without its mtime changing
+        if isinstance(key, list) and key[0] > self.started - RACY_DELAY * 10**9:
+            return
+        self.seen[fpath] = [key, lines, size]
+        self.dirty = True
+
+    def save(self):
+        # files neither changed, added nor removed
+        if not self.dirty and len(self.seen) == len(self.entries):
+            return
+        tmp = self.fpath + '.tmp'
+        with open(tmp, 'w') as f:
+            # dumps uses the C encoder, dump does not
+            f.write(json.dumps({'version': CACHE_VERSION,
+                'counter': self.counter, 'files': self.seen},
+                separators=(',', ':')))
+        os.replace(tmp, self.fpath)
+
 class Statistics(object):
     def __init__(self, verbose,
         exclude_files, exclude_dirs, include_files, include_dirs,
-        no_comment):
+        no_comment, jobs=1, threads=0, cache=None, git=False, watch=False):
         super(Statistics, self).__init__()
         # options
         self.verbose = verbose
-        self.exclude_files = set(filter(None, exclude_files.split(',')))
-        self.exclude_dirs = set(filter(None, exclude_dirs.split(',')))
-        self.include_files = set(filter(None, include_files.split(',')))
-        self.include_dirs = set(filter(None, include_dirs.split(',')))
+        self.jobs = jobs
+        self.threads = threads
+        self.counter = classify_lines if no_comment else count_lines
+        self.cache = StatCache(cache, self.counter.__name__) if cache else None
+        self.git = git
+        self.exclude_files = Patterns(exclude_files)
+        self.exclude_dirs = Patterns(exclude_dirs)
+        self.include_files = Patterns(include_files)
+        self.include_dirs = Patterns(include_dirs)
         self.no_comment = no_comment
         # statistics
-        self.root = None 
-        self.extensions = set()
+        self.roots = []
         self.file_cnt = 0
+        self.binary_cnt = 0
         self.kloc = 0
+        # extension ('' if none): [files, lines]
+        self.extensions = {}
+        # files and directories
+        self.table = FileTable()
+        # language: [files, code, comment, blank lines], with no_comment
+        self.languages = {}
+        # path of a walked directory: index in the table
+        self.__dirs = {}
+        # path of a file: [stat key, lines, size, row], kept when watching
+        self.__files = {} if watch else None
+        # watched files which are symbolic links
+        self.__links = set()
+
+    def __dir_of(self, dirpath, top):
+        directory = self.__dirs.get(dirpath)
+        if directory is None:
+            if dirpath == top:
+                directory = self.table.add_dir(-1, top)
+            else:
+                parent, name = os.path.split(dirpath)
+                directory = self.table.add_dir(self.__dir_of(parent, top), name)
+            self.__dirs[dirpath] = directory
+        return directory
 
-    def __scan_file(self, fpath, fname):
+    def __add_file(self, fpath, fname, directory, key, size, lines):
+        if self.__files is not None:
+            self.__files[fpath] = [key, lines, size, len(self.table)
+                if lines is not None else -1]
+        if lines is None:
+            if self.verbose:
+                print('skipping binary file: %s' % fname)
+            self.binary_cnt += 1
+            return
         if self.verbose:
             print('scanning: %s' % fname)
         self.file_cnt += 1
-        if '.' in fname:
-            self.extensions.add(fname.split('.')[-1])
-        with open(fpath, 'r') as f:
-            self.kloc += len(f.read().split('\n'))
-
-    def __include_dirs(self, dirs):
-        kept = set()
-        for d in dirs:
-            for pattern in self.include_dirs:
-                if fnmatch.fnmatch(d, pattern):
-                    kept.add(d)
-                    break
-        return kept
-
-    def __exclude_dirs(self, dirs):
-        kept = set()
-        for d in dirs:
-            keep = True
-            for pattern in self.exclude_dirs:
-                if fnmatch.fnmatch(d, pattern):
-                    keep = False
-            if keep:
-                kept.add(d)
-        return kept
-
-    def scan(self, dirpath):
-        self.root = dirpath
-        for root, dirs, files in os.walk(self.root):
+        if self.no_comment:
+            code, comment, blank = lines
+            language = self.languages.setdefault(language_of(fname), [0, 0, 0, 0])
+            language[0] += 1
+            language[1] += code
+            language[2] += comment
+            language[3] += blank
+            lines = code
+        self.kloc += lines
+        extension = self.extensions.setdefault(
+            fname.split('.')[-1] if '.' in fname else '', [0, 0])
+        extension[0] += 1
+        extension[1] += lines
+        self.table.add_file(directory, fname, size, lines)
+
+    def __remove_file(self, fpath):
+        # undo __add_file of a watched file
+        key, lines, size, row = self.__files.pop(fpath)
+        if lines is None:
+            self.binary_cnt -= 1
+            return
+        if self.verbose:
+            print('removing: %s' % fpath)
+        fname = os.path.basename(fpath)
+        self.file_cnt -= 1
+        if self.no_comment:
+            code, comment, blank = lines
+            language = self.languages[language_of(fname)]
+            language[0] -= 1
+            language[1] -= code
+            language[2] -= comment
+            language[3] -= blank
+            lines = code
+        self.kloc -= lines
+        extension = self.extensions[fname.split('.')[-1] if '.' in fname else '']
+        extension[0] -= 1
+        extension[1] -= lines
+        self.table.remove_file(row)
+
+    def __keep_file(self, fname, parent):
+        if len(self.include_files) > 0:
+            return self.include_files.match(fname, parent)
+        return not self.exclude_files.match(fname, parent)
+
+    def __keep_dir(self, dname, parent):
+        if len(self.include_dirs) > 0:
+            return self.include_dirs.match(dname, parent)
+        return not self.exclude_dirs.match(dname, parent)
+
+    def __relpath(self, root, top):
+        # path of a walked directory relative to the scanned one
+        relpath = root[len(top):].lstrip(os.sep)
+        return relpath.replace(os.sep, '/') if os.sep != '/' else relpath
+
+    def __walk(self, top, start=None):
+        # start is a directory below top, e.g. created while watching
+        for root, dirs, files in os.walk(start or top):
             if self.verbose:
                 print('entering: %s' % root)
+            parent = self.__relpath(root, top)
+            directory = self.__dir_of(root, top)
             # include or exclude dirs
-            if len(self.include_dirs) > 0:
-                dirs[:] = self.__include_dirs(dirs)
-            else:
-                dirs[:] = self.__exclude_dirs(dirs) 
+            dirs[:] = [d for d in dirs if self.__keep_dir(d, parent)]
             # scan files
             for f in files:
-                if len(self.include_files) > 0:
-                    for pattern in self.include_files:
-                        if fnmatch.fnmatch(f, pattern):
-                            self.__scan_file(os.path.join(root, f), f)
-                            break
+                if self.__keep_file(f, parent):
+                    yield os.path.join(root, f), f, directory, None
+
+    def __parallel_walk(self, walkers):
+        # directories of every root are listed by a thread pool (I/O bound),
+        # which also stats files when a cache is used
+        with_keys = self.cache is not None or self.__files is not None
+        pending = {walkers.submit(list_dir, top, with_keys): (top, top)
+            for top in self.roots}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root, top = pending.pop(future)
+                entries, files = future.result()
+                if self.verbose:
+                    print('entering: %s' % root)
+                parent = self.__relpath(root, top)
+                directory = self.__dir_of(root, top)
+                # include or exclude dirs
+                for d, is_link in entries:
+                    if not is_link and self.__keep_dir(d, parent):
+                        subdir = os.path.join(root, d)
+                        pending[walkers.submit(list_dir, subdir, with_keys)] = (subdir, top)
+                # scan files
+                for f, key in files:
+                    if self.__keep_file(f, parent):
+                        yield os.path.join(root, f), f, directory, key
+
+    def __git_walk(self, top):
+        # directory patterns apply to every directory of a path, as when
+        # walking the tree
+        kept = {'': True}
+        def keep(dname):
+            if dname not in kept:
+                parent, d = os.path.split(dname)
+                kept[dname] = keep(parent) and self.__keep_dir(d, parent)
+            return kept[dname]
+        for path, blob in git_files(top):
+            dname, fname = os.path.split(path)
+            if keep(dname) and self.__keep_file(fname, dname):
+                root = os.path.join(top, dname) if dname else top
+                yield (os.path.join(top, path), fname,
+                    self.__dir_of(root, top), blob)
+
+    def __walk_roots(self, walkers):
+        if self.git:
+            for top in self.roots:
+                yield from self.__git_walk(top)
+        elif self.jobs > 1:
+            yield from self.__parallel_walk(walkers)
+        else:
+            for top in self.roots:
+                yield from self.__walk(top)
+
+    def __lookup(self, fpath, key):
+        # return (key, cache entry), entry is None on cache miss; files are
+        # only stat'ed when cached or watched
+        if self.cache is None and self.__files is None:
+            return None, None
+        if key is None:
+            try:
+                key = stat_key(fpath)
+            except OSError:
+                # e.g. deleted but still in the git index, broken symlink
+                return None, None
+        if self.cache is None:
+            return key, None
+        return key, self.cache.get(fpath, key)
+
+    def __add_counted(self, fpath, fname, directory, key, counted):
+        size, lines = counted
+        if self.cache is not None and key is not None:
+            self.cache.put(fpath, key, lines, size)
+        self.__add_file(fpath, fname, directory, key, size, lines)
+
+    def __count_batch(self, counters, batch, counting):
+        # file names and keys are kept by this process, paths only go to
+        # workers
+        future = counters.submit(count_batch, self.counter,
+            [fpath for fpath, _, _, _ in batch])
+        counting.append((future, batch))
+
+    def scan(self, *dirpaths):
+        # roots are scanned at once, sharing walkers and counters
+        self.roots += [os.path.normpath(dirpath) for dirpath in dirpaths]
+        if self.cache is not None:
+            self.cache.load()
+        with ThreadPoolExecutor(self.threads or None) as walkers:
+            files = self.__walk_roots(walkers)
+            if self.jobs > 1:
+                self.__parallel_count(files)
+            else:
+                for fpath, fname, directory, key in files:
+                    key, entry = self.__lookup(fpath, key)
+                    if entry is not None:
+                        self.__add_file(fpath, fname, directory, key, entry[2],
+                            entry[1])
+                    else:
+                        self.__add_counted(fpath, fname, directory, key,
+                            count_file(self.counter, fpath))
+        if self.cache is not None:
+            self.cache.save()
+
+    def __parallel_count(self, files):
+        # files are read and counted by a process pool (CPU bound) as soon as
+        # they are found
+        with ProcessPoolExecutor(self.jobs) as counters:
+            counting = []
+            batch = []
+            for fpath, fname, directory, key in files:
+                key, entry = self.__lookup(fpath, key)
+                if entry is not None:
+                    self.__add_file(fpath, fname, directory, key, entry[2],
+                        entry[1])
+                    continue
+                batch.append((fpath, fname, directory, key))
+                if len(batch) >= BATCH_SIZE:
+                    self.__count_batch(counters, batch, counting)
+                    batch = []
+            if batch:
+                self.__count_batch(counters, batch, counting)
+            for future, batch in counting:
+                for (fpath, fname, directory, key), counted in zip(batch,
+                        future.result()):
+                    self.__add_counted(fpath, fname, directory, key, counted)
+
+    def __top_of(self, dirpath):
+        # scanned root containing dirpath, None if there is none
+        while dirpath not in self.roots:
+            parent = os.path.dirname(dirpath)
+            if parent == dirpath:
+                return None
+            dirpath = parent
+        return dirpath
+
+    def __refresh(self, fpath, fname, directory):
+        # count a file again if it changed, return whether it did
+        try:
+            key = stat_key(fpath)
+        except OSError:
+            key = None
+        entry = self.__files.get(fpath)
+        if entry is not None and entry[0] == key:
+            return False
+        if entry is not None:
+            self.__remove_file(fpath)
+        if key is None:
+            return entry is not None
+        try:
+            counted = count_file(self.counter, fpath)
+        except OSError:
+            # removed meanwhile, or not a regular file
+            return entry is not None
+        self.__add_file(fpath, fname, directory, key, *counted)
+        return True
+
+    def __refresh_path(self, path):
+        # path of an event, only files which would be scanned are counted
+        dirpath, fname = os.path.split(path)
+        directory = self.__dirs.get(dirpath)
+        if directory is None:
+            return False
+        if path not in self.__files:
+            parent = self.__relpath(dirpath, self.__top_of(dirpath))
+            if not self.__keep_file(fname, parent):
+                return False
+        return self.__refresh(path, fname, directory)
+
+    def __add_tree(self, dirpath, notifier):
+        # scan a directory created while watching
+        parent, name = os.path.split(dirpath)
+        top = self.__top_of(parent)
+        if (parent not in self.__dirs or dirpath in self.__dirs
+                or not self.__keep_dir(name, self.__relpath(parent, top))):
+            return False
+        changed = False
+        for fpath, fname, directory, _ in self.__walk(top, dirpath):
+            changed = self.__refresh(fpath, fname, directory) or changed
+        for subdir in list(self.__dirs):
+            if subdir == dirpath or subdir.startswith(dirpath + os.sep):
+                notifier.add(subdir)
+        return changed
+
+    def __remove_tree(self, dirpath):
+        # forget a directory removed while watching
+        prefix = dirpath + os.sep
+        fpaths = [fpath for fpath in self.__files if fpath.startswith(prefix)]
+        for fpath in fpaths:
+            self.__remove_file(fpath)
+        for subdir in [d for d in self.__dirs
+                if d == dirpath or d.startswith(prefix)]:
+            del self.__dirs[subdir]
+        return len(fpaths) > 0
+
+    def __poll(self):
+        # compare stat keys of every file, as the cache does
+        changed = False
+        seen = set()
+        with ThreadPoolExecutor(self.threads or None) as walkers:
+            for fpath, fname, directory, key in self.__walk_roots(walkers):
+                seen.add(fpath)
+                entry = self.__files.get(fpath)
+                if entry is not None and key is not None and entry[0] == key:
+                    continue
+                changed = self.__refresh(fpath, fname, directory) or changed
+        for fpath in [fpath for fpath in self.__files if fpath not in seen]:
+            self.__remove_file(fpath)
+            changed = True
+        return changed
+
+    def __notified(self, notifier, interval):
+        # events are gathered for interval seconds after the first one
+        events = notifier.read()
+        time.sleep(interval)
+        events += notifier.read(0)
+        changed = False
+        for path, mask in events:
+            if path is None:
+                # queue overflow, events were lost
+                if self.verbose:
+                    print('events lost, polling')
+                return self.__poll() or changed
+            if not mask & IN_ISDIR:
+                changed = self.__refresh_path(path) or changed
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.islink(path):
+                    self.__links.add(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changed = self.__remove_tree(path) or changed
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                changed = self.__add_tree(path, notifier) or changed
+        # targets of symbolic links may be outside of watched directories
+        for path in list(self.__links):
+            changed = self.__refresh_path(path) or changed
+            if path not in self.__files:
+                self.__links.discard(path)
+        return changed
+
+    def watch(self, emit, interval):
+        # keep statistics of scanned roots up to date, calling emit after
+        # changes; directories are polled every interval seconds when
+        # inotify is not available
+        notifier = None
+        try:
+            notifier = Inotify()
+            for dirpath in self.__dirs:
+                notifier.add(dirpath)
+            self.__links = set(fpath for fpath in self.__files
+                if os.path.islink(fpath))
+        except (OSError, AttributeError) as exc:
+            # not Linux, or too many directories (fs.inotify.max_user_watches)
+            if notifier is not None:
+                notifier.close()
+            notifier = None
+            if self.verbose:
+                print('polling directories: %s' % exc)
+        try:
+            while True:
+                if notifier is None:
+                    time.sleep(interval)
+                    changed = self.__poll()
                 else:
-                    skip = False
-                    for pattern in self.exclude_files:
-                        if fnmatch.fnmatch(f, pattern):
-                            skip = True
-                    if not skip:
-                        self.__scan_file(os.path.join(root, f), f)
-
-    def print(self):
+                    changed = self.__notified(notifier, interval)
+                if changed:
+                    emit()
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+    def report(self, top=TOP):
+        # JSON serializable statistics, see merge
+        table = self.table
+        report = {
+            'version': REPORT_VERSION,
+            'roots': self.roots,
+            'files': self.file_cnt,
+            'binary_files': self.binary_cnt,
+            'lines': self.kloc,
+            'extensions': {ext: {'files': files, 'lines': lines}
+                for ext, (files, lines) in self.extensions.items()},
+            'directories': {table.dir_path(d): {'files': table.dir_files[d],
+                'lines': table.dir_lines[d], 'size': table.dir_size[d]}
+                for d in range(len(table.dir_parent)) if table.dir_files[d]},
+            'largest_files': [{'path': table.file_path(f),
+                'size': table.file_size[f], 'lines': table.file_lines[f]}
+                for f in table.largest_files(top)],
+            'largest_directories': [{'path': table.dir_path(d),
+                'files': table.dir_files[d], 'lines': table.dir_lines[d],
+                'size': table.dir_size[d]}
+                for d in table.largest_dirs(top)],
+            # files smaller than below and at least half as large
+            'size_histogram': [{'below': 2**k, 'files': files}
+                for k, files in enumerate(table.histogram) if files],
+        }
+        if self.no_comment:
+            report['languages'] = {language: dict(zip(LANGUAGE_COLUMNS, counts))
+                for language, counts in self.languages.items()}
+        return report
+
+    def merge(self, report):
+        # add statistics of a report, e.g. saved by a previous run
+        if report.get('version') != REPORT_VERSION:
+            raise ValueError('unsupported report version: %r'
+                % report.get('version'))
+        self.roots += report['roots']
+        self.file_cnt += report['files']
+        self.binary_cnt += report['binary_files']
+        self.kloc += report['lines']
+        for ext, counts in report['extensions'].items():
+            entry = self.extensions.setdefault(ext, [0, 0])
+            entry[0] += counts['files']
+            entry[1] += counts['lines']
+        # directories of reports are kept as roots, reported files are only
+        # listed
+        table = self.table
+        for dirpath, counts in report['directories'].items():
+            d = table.add_dir(-1, dirpath)
+            table.dir_files[d] += counts['files']
+            table.dir_lines[d] += counts['lines']
+            table.dir_size[d] += counts.get('size', 0)
+        for entry in report.get('largest_files', ()):
+            dirpath, fname = os.path.split(entry['path'])
+            table.add_file(table.add_dir(-1, dirpath), fname, entry['size'],
+                entry['lines'], count=False)
+        for entry in report.get('size_histogram', ()):
+            table.histogram[entry['below'].bit_length() - 1] += entry['files']
+        if 'languages' in report:
+            self.no_comment = True
+            for language, counts in report['languages'].items():
+                entry = self.languages.setdefault(language, [0, 0, 0, 0])
+                for k, column in enumerate(LANGUAGE_COLUMNS):
+                    entry[k] += counts[column]
+
+    def print_json(self, file=None, top=TOP):
+        json.dump(self.report(top), file or sys.stdout, indent=2,
+            sort_keys=True)
+        print(file=file)
+
+    def print_csv(self, file=None, top=TOP):
+        # one row per total, extension, language, directory, largest file
+        # and size class
+        table = self.table
+        writer = csv.writer(file or sys.stdout, lineterminator='\n')
+        writer.writerow(('kind', 'name', 'files', 'lines', 'code', 'comment',
+            'blank', 'size'))
+        # directories of merged reports are roots of the table as well, only
+        # scanned or reported roots are totalled
+        roots = set(self.roots)
+        writer.writerow(('total', '', self.file_cnt, self.kloc, '', '', '',
+            sum(table.dir_size[d] for d in range(len(table.dir_parent))
+                if table.dir_parent[d] < 0 and table.dir_path(d) in roots)))
+        writer.writerow(('binary', '', self.binary_cnt, '', '', '', '', ''))
+        for ext, (files, lines) in sorted(self.extensions.items()):
+            writer.writerow(('extension', ext, files, lines, '', '', '', ''))
+        for language, (files, code, comment, blank) in sorted(
+                self.languages.items()):
+            writer.writerow(('language', language, files, code, code, comment,
+                blank, ''))
+        for dirpath, d in sorted((table.dir_path(d), d)
+                for d in range(len(table.dir_parent)) if table.dir_files[d]):
+            writer.writerow(('directory', dirpath, table.dir_files[d],
+                table.dir_lines[d], '', '', '', table.dir_size[d]))
+        for f in table.largest_files(top):
+            writer.writerow(('file', table.file_path(f), 1,
+                table.file_lines[f], '', '', '', table.file_size[f]))
+        for k, files in enumerate(table.histogram):
+            if files:
+                writer.writerow(('size_below', 2**k, files, '', '', '', '',
+                    ''))
+
+    def print(self, file=None, top=0):
         print("""
 project root directory: %s
 statistics:
     + scanned file extensions: %s
     + file count: %s
+    + binary file count: %s
     + kloc: %s
-""" % (
-            self.root,
-            self.extensions,
+%s""" % (
+            ', '.join(self.roots),
+            # sorted so that output does not depend on scanning order
+            '{%s}' % ', '.join(repr(ext) for ext in sorted(self.extensions)
+                if ext),
             self.file_cnt,
-            self.kloc
-        ))
+            self.binary_cnt,
+            self.kloc,
+            '' if self.cache is None else
+                '    + files read from cache: %s\n' % self.cache.hits
+        ) + ''.join(
+            '    + %s: %d files, %d code, %d comment, %d blank lines\n'
+                % ((language,) + tuple(counts))
+            for language, counts in sorted(self.languages.items())),
+            file=file)
+        if top > 0:
+            self.__print_largest(file, top)
+
+    def __print_largest(self, file, top):
+        table = self.table
+        print('largest files:', file=file)
+        for f in table.largest_files(top):
+            print('    + %s: %d bytes, %d lines' % (table.file_path(f),
+                table.file_size[f], table.file_lines[f]), file=file)
+        print('largest directories:', file=file)
+        for d in table.largest_dirs(top):
+            print('    + %s: %d bytes, %d files, %d lines' % (table.dir_path(d),
+                table.dir_size[d], table.dir_files[d], table.dir_lines[d]),
+                file=file)
 #-------------------------------------------------------------------------------
 #   FUNCTIONS
 #-------------------------------------------------------------------------------
 def create_argv_parser():
-    parser = argparse.ArgumentParser(usage='%s(prog)s [options] directory',
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s [options] directory [directory ...]',
         add_help=True, allow_abbrev=False, 
         description='A simple tool computing statistics about development project.')
     parser.add_argument('-v', '--verbose', action='store_true', 
         help='increase program verbosity')
     parser.add_argument('--exclude-files', default='', 
-        help='comma-separated list of excluded file patterns')
+        help='comma-separated list of excluded file patterns, patterns '
+             'containing a / match paths relative to the directory')
     parser.add_argument('--exclude-dirs', default='', 
         help='comma-separated list of excluded dir. patterns')
     parser.add_argument('--include-files', default='', 
@@ -120,8 +1236,41 @@ def create_argv_parser():
     parser.add_argument('--include-dirs', default='', 
         help='comma-separated list of included dir. patterns')
     parser.add_argument('--no-comment', action='store_true', 
-        help='ignore comment lines')
-    parser.add_argument('directory', help='input director(y|ies)')
+        help='ignore comment and blank lines, lines are classified by '
+             'language')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of processes counting lines, more than one enables '
+             'parallel scanning')
+    parser.add_argument('--threads', type=int, default=0,
+        help='number of threads listing directories when scanning in '
+             'parallel, defaults to a value depending on the number of CPUs')
+    parser.add_argument('--cache', metavar='FILE',
+        help='file caching line counts of files between scans, only modified '
+             'files are read again')
+    parser.add_argument('--git', action='store_true',
+        help='scan files of the git work tree (tracked and untracked but not '
+             'ignored) instead of walking the directory, with --cache '
+             'unmodified tracked files are not even stat\'ed')
+    parser.add_argument('-f', '--format', choices=('text', 'json', 'csv'),
+        default='text',
+        help='output format, json and csv include counts by extension and '
+             'by directory')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='write statistics to this file instead of standard output')
+    parser.add_argument('--top', type=int, metavar='N',
+        help='number of largest files and directories reported, %d in json '
+             'and csv output by default' % TOP)
+    parser.add_argument('--watch', type=float, nargs='?', const=2.0,
+        metavar='SECONDS',
+        help='after scanning, keep statistics up to date and print them '
+             'again when files change; changes are gathered for SECONDS (2 '
+             'by default), directories are polled as often when inotify is '
+             'not available')
+    parser.add_argument('--merge', action='store_true',
+        help='directories are JSON reports (see --format) to merge instead '
+             'of directories to scan')
+    parser.add_argument('directories', nargs='+', metavar='directory',
+        help='input director(y|ies), scanned at once')
     return parser
 
 def usage():
@@ -131,13 +1280,47 @@ def usage():
 def main():
     parser = create_argv_parser()
     args = parser.parse_args()
+    watch = args.watch is not None
+    if watch and (args.git or args.merge):
+        parser.error('--watch cannot be used with --git or --merge')
     stats = Statistics(
         args.verbose,
         args.exclude_files, args.exclude_dirs, 
         args.include_files, args.include_dirs,
-        args.no_comment)
-    stats.scan(args.directory)
-    stats.print()
+        args.no_comment, args.jobs, args.threads, args.cache, args.git, watch)
+    if args.merge:
+        for fpath in args.directories:
+            try:
+                with open(fpath) as f:
+                    stats.merge(json.load(f))
+            except (OSError, ValueError, KeyError) as exc:
+                print('error: cannot merge %s: %s' % (fpath, exc))
+                exit(1)
+    else:
+        try:
+            stats.scan(*args.directories)
+        except subprocess.CalledProcessError as exc:
+            print('error: git failed with code %d' % exc.returncode)
+            exit(1)
+    printer = {'text': stats.print, 'json': stats.print_json,
+        'csv': stats.print_csv}[args.format]
+    options = {} if args.top is None else {'top': args.top}
+    def emit():
+        if args.output is None:
+            printer(**options)
+            sys.stdout.flush()
+            return
+        # readers of the output never see a partial report
+        tmp = args.output + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            printer(f, **options)
+        os.replace(tmp, args.output)
+    emit()
+    if watch:
+        try:
+            stats.watch(emit, args.watch)
+        except KeyboardInterrupt:
+            pass
 
 #-------------------------------------------------------------------------------
 #   SCRIPT
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -!- encoding:utf8 -!-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: bench.py
+#  purpose:
+#
+#  license:
+#    hid_decoder Decoder for USB HID data
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import io
+import random
+from time import perf_counter
+from keys import Key, Modifier
+from keymap import KEYMAP, load_layout
+from main import HIDDecoder
+from pathlib import Path
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+def make_reports(count, seed=0):
+    # random keyboard reports: a modifier, a reserved byte and up to 3 keys
+    rnd = random.Random(seed)
+    codes = [key.value for key in Key if key.value < 0xE0]
+    reports = []
+    for _ in range(count):
+        keys = rnd.sample(codes, rnd.randint(0, 3))
+        keys += [0] * (6 - len(keys))
+        reports.append([rnd.choice((0x00, 0x00, 0x02, 0x01, 0x20)), 0x00] + keys)
+
+    return reports
+
+def enum_decode(decoder, lbytes):
+    # decode_keyboard before lookup tables: enums are built for each report
+    mod = Modifier(lbytes[0])
+    keys = [Key(k) for k in lbytes[2:]]
+    index = 1 if mod == Modifier.LEFT_SHIFT else 0
+    mapped = []
+    for k in keys:
+        if decoder.num_locked and k.name.startswith('KEY_PAD'):
+            index = 1
+
+        mapped.append(KEYMAP[k][index])
+
+    if mod == Modifier.NONE and keys.count(Key.NONE) == 6:
+        return "Key released."
+
+    return "Key pressed: (mod={}) keys={} -> chars={}".format(
+        mod.name, [k.name for k in keys], mapped)
+
+def measure(label, func, count):
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+    print("    {:<28} {:8.3f}s {:10.0f} ns/report".format(label, elapsed,
+                                                        elapsed / count * 1e9))
+
+def main():
+    p = ArgumentParser(description="Per-report decode cost of the HID decoder.")
+    p.add_argument('--reports', '-n', type=int, default=200000,
+                   help="Number of synthetic reports.")
+    args = p.parse_args()
+
+    start = perf_counter()
+    load_layout('fr_fr')
+    print("fr_fr layout loaded in {:.3f}ms".format((perf_counter() - start) * 1e3))
+
+    reports = make_reports(args.reports)
+    decoder = HIDDecoder(None)
+    assert [enum_decode(decoder, r) for r in reports[:1000]] == \
+           [decoder.decode_keyboard(r) for r in reports[:1000]]
+    print("{} reports".format(len(reports)))
+    measure('enum lookups', lambda: [enum_decode(decoder, r) for r in reports],
+            len(reports))
+    measure('lookup tables', lambda: [decoder.decode_keyboard(r) for r in reports],
+            len(reports))
+
+    with TemporaryDirectory() as tmpdir:
+        capture = Path(tmpdir).joinpath('capture.txt')
+        with capture.open('w') as fp:
+            for report in reports:
+                fp.write(':'.join('{:02x}'.format(b) for b in report) + '\n')
+
+        decoder = HIDDecoder(capture)
+        out = io.StringIO()
+        measure('batch (whole capture)', lambda: decoder.decode_batch(out),
+                len(reports))
+# =============================================================================
+#  SCRIPT
+# =============================================================================
+if __name__ == '__main__':
+    main()
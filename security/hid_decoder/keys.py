@@ -262,4 +262,13 @@ class Key(Enum):
     KEY_RIGHT_SHIFT = 0xE5
     KEY_RIGHT_ALT = 0xE6
     KEY_RIGHT_GUI = 0xE7
-    #RESERVED = 0xE8-0xFFFF
\ No newline at end of file
+    #RESERVED = 0xE8-0xFFFF
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+# tables indexed by raw codes, built once
+MODIFIER_NAMES = tuple(Modifier(m).name for m in range(256))
+# None for reserved codes
+KEY_NAMES = tuple({key.value: key.name for key in Key}.get(k) for k in range(256))
+# bit k is set if code k is a keypad key
+KEYPAD_MASK = sum(1 << key.value for key in Key if key.name.startswith('KEY_PAD'))
@@ -0,0 +1,61 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: fr_fr.py
+#  purpose:
+#
+#  license:
+#    hid_decoder Decoder for USB HID data
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+from keys import Key
+from layouts.en_us import KEYMAP as EN_US_KEYMAP
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+# AZERTY, keys not listed here are those of en_us
+KEYMAP = dict(EN_US_KEYMAP)
+KEYMAP.update({
+    Key.KEY_A:                  ('q', 'Q'),
+    Key.KEY_M:                  (',', '?'),
+    Key.KEY_Q:                  ('a', 'A'),
+    Key.KEY_W:                  ('z', 'Z'),
+    Key.KEY_Z:                  ('w', 'W'),
+    Key.KEY_1:                  ('&', '1'),
+    Key.KEY_2:                  ('é', '2'),
+    Key.KEY_3:                  ('"', '3'),
+    Key.KEY_4:                  ("'", '4'),
+    Key.KEY_5:                  ('(', '5'),
+    Key.KEY_6:                  ('-', '6'),
+    Key.KEY_7:                  ('è', '7'),
+    Key.KEY_8:                  ('_', '8'),
+    Key.KEY_9:                  ('ç', '9'),
+    Key.KEY_0:                  ('à', '0'),
+    Key.KEY_MINUS:              (')', '°'),
+    Key.KEY_EQUAL:              ('=', '+'),
+    Key.KEY_LEFT_BRACKET:       ('^', '¨'),
+    Key.KEY_RIGHT_BRACKET:      ('$', '£'),
+    Key.KEY_BACKSLASH:          ('*', 'µ'),
+    Key.KEY_HASH:               ('*', 'µ'),
+    Key.KEY_SEMICOLON:          ('m', 'M'),
+    Key.KEY_QUOTE:              ('ù', '%'),
+    Key.KEY_GRAVE_ACCENT:       ('²', ''),
+    Key.KEY_COMMA:              (';', '.'),
+    Key.KEY_DOT:                (':', '/'),
+    Key.KEY_SLASH:              ('!', '§'),
+    Key.KEY_NON_US_BACKSLASH:   ('<', '>'),
+})
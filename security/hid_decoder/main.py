@@ -27,30 +27,62 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
-from keys import Key, Modifier
-from keymap import KEYMAP
+import re
+import sys
+from keys import Key, Modifier, MODIFIER_NAMES, KEY_NAMES, KEYPAD_MASK
+from keymap import LAYOUTS, load_layout
 from pathlib import Path
 from argparse import ArgumentParser
 # =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+# lines parsed at once by decode_batch, others go through decode_line
+KEYBOARD_REPORT = re.compile(r'[0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){7}')
+REPORT_LENGTH = 23
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+def is_report_length(line):
+    return len(line) == REPORT_LENGTH
+
+def parse_reports(lines):
+    # return (predicate selecting keyboard report lines, matrix of their
+    # 8-byte reports): reports are 8 hex bytes separated by colons, lines of
+    # that length are checked and parsed at once
+    text = ':'.join(line for line in lines if len(line) == REPORT_LENGTH)
+    matrix = None
+    if text[2::3].count(':') == len(text[2::3]):
+        try:
+            matrix = bytes.fromhex(text.replace(':', ''))
+        except ValueError:
+            pass
+
+    if matrix is not None and len(matrix) * 3 == len(text) + 1:
+        return is_report_length, matrix
+
+    # some lines only look like reports, check them one by one
+    is_report = KEYBOARD_REPORT.fullmatch
+    text = ''.join(line for line in lines if is_report(line))
+    return is_report, bytes.fromhex(text.replace(':', ''))
+# =============================================================================
 #  CLASSES
 # =============================================================================
 class HIDDecoder:
-    def __init__(self, input_file, chars_only=False):
+    def __init__(self, input_file, chars_only=False, layout='en_us'):
         self.num_locked = False
         self.input_file = input_file
         self.chars_only = chars_only
+        self.keymap = load_layout(layout)
 
     def apply_keymap(self, mod, keys):
-        index = 1 if mod == Modifier.LEFT_SHIFT else 0
+        index = 1 if mod == Modifier.LEFT_SHIFT.value else 0
 
         chars = []
         for k in keys:
-            key_variants = KEYMAP[k]
-
-            if k.name.startswith('KEY_PAD') and self.num_locked:
+            if self.num_locked and KEYPAD_MASK >> k & 1:
                 index = 1
 
-            chars.append(key_variants[index])
+            chars.append(self.keymap[index][k])
 
         return chars
 
@@ -58,17 +90,23 @@ class HIDDecoder:
         raise NotImplementedError("not implemented.")
 
     def decode_keyboard(self, lbytes):
-        mod = Modifier(lbytes[0])
-        keys = [Key(k) for k in lbytes[2:]]
+        mod, keys = lbytes[0], lbytes[2:]
+        # the enums reject (or name) codes out of the tables
+        mod_name = MODIFIER_NAMES[mod] if 0 <= mod < 256 else Modifier(mod).name
+        names = [KEY_NAMES[k] if 0 <= k < 256 else None for k in keys]
+        if None in names:
+            # raises ValueError
+            names = [Key(k).name for k in keys]
+
         mapped = self.apply_keymap(mod, keys)
 
-        if mod == Modifier.NONE and keys.count(Key.NONE) == 6:
+        if mod == Modifier.NONE.value and keys.count(Key.NONE.value) == 6:
             return "Key released."
 
         if self.chars_only:
             return "{}".format(mapped)
 
-        return "Key pressed: (mod={}) keys={} -> chars={}".format(mod.name, [k.name for k in keys], mapped)
+        return "Key pressed: (mod={}) keys={} -> chars={}".format(mod_name, names, mapped)
 
     def decode_line(self, line):
         if len(line) == 0:
@@ -85,6 +123,42 @@ class HIDDecoder:
         else:
             return "[NOT KEYBOARD DATA]"
 
+    def decode_batch(self, out=None):
+        # same output as decode: keyboard reports of the whole capture are
+        # parsed into a matrix of bytes and each distinct report is decoded
+        # once, other lines are decoded one by one
+        with self.input_file.open('r') as fp:
+            lines = fp.read().split('\n')
+
+        if lines[-1] == '':
+            lines.pop()
+
+        lines = [line.strip() for line in lines]
+        is_report, matrix = parse_reports(lines)
+        # decoded reports, for each num lock state
+        decoded = ({}, {})
+        output = []
+        row = 0
+        try:
+            for line in lines:
+                if not is_report(line):
+                    output.append(self.decode_line(line))
+                    continue
+
+                report = matrix[row:row + 8]
+                row += 8
+                cache = decoded[self.num_locked]
+                text = cache.get(report)
+                if text is None:
+                    text = cache[report] = self.decode_keyboard(report)
+
+                output.append(text)
+
+        finally:
+            # lines decoded before an error are printed, as by decode
+            if output:
+                (out or sys.stdout).write('\n'.join(output) + '\n')
+
     def decode(self):
         with self.input_file.open('r') as fp:
             for line in fp:
@@ -96,8 +170,15 @@ class HIDDecoder:
 if __name__ == '__main__':
     p = ArgumentParser()
     p.add_argument('--chars-only', '-c', action='store_true')
+    p.add_argument('--layout', '-l', choices=sorted(LAYOUTS), default='en_us',
+                   help="Keyboard layout, en_us by default.")
+    p.add_argument('--batch', '-b', action='store_true',
+                   help="Decode the whole capture at once, output is the same.")
     p.add_argument('input_file', type=Path, help="Input file to be decoded.")
     args = p.parse_args()
 
-    decoder = HIDDecoder(args.input_file, args.chars_only)
-    decoder.decode()
\ No newline at end of file
+    decoder = HIDDecoder(args.input_file, args.chars_only, args.layout)
+    if args.batch:
+        decoder.decode_batch()
+    else:
+        decoder.decode()
\ No newline at end of file